@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""Replay download storms against the Handler pipeline and time them.
+
+Each workload gets a fresh temp directory, a ``Watcher`` on it and a
+``Handler`` built from the real FileTypeHandlers (destinations redirected
+into the temp tree). Stub pyrocksmith, llamafile and scp executables stand
+in for the external tools, so the whole run is offline. Latency is measured
+per file from the moment the workload finishes writing (or renaming) it to
+the moment its handler returns, so it includes stabilization and queueing.
+
+Results are written as JSON; ``--compare`` prints the change against an
+earlier run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from wayward.catalog import Catalog
+from wayward.config import DISPATCH_QUEUE_SIZE, DISPATCH_WORKERS, IMAGE_SUFFIXES
+from wayward.convert import ConversionScheduler
+from wayward.describe import DescriptionService
+from wayward.dispatch import Dispatcher
+from wayward.journal import Journal
+from wayward.main import (
+    FileTypeHandler,
+    Handler,
+    ImageHandler,
+    PsarcHandler,
+    ScreenshotHandler,
+    Watcher,
+)
+from wayward.metrics import EVENTS
+from wayward.routing import FIRST, Router, Rule
+from wayward.transport import SshTransport
+
+logger = logging.getLogger(__name__)
+
+WORKLOADS = ("screenshots", "slow", "psarc", "partial", "describe")
+TIMEOUT = 300
+
+STUB_PYROCKSMITH = """\
+#!{python}
+# Stand-in for pyrocksmith --convert: emit an _m/_p pair next to the source.
+import shutil, sys, time
+from pathlib import Path
+source = Path(sys.argv[2])
+time.sleep({delay})
+for tag in ("m", "p"):
+    shutil.copyfile(source, source.with_name(f"{{source.stem}}_{{tag}}.psarc"))
+source.unlink()
+"""
+
+STUB_SCP = """\
+#!{python}
+# Stand-in for scp: copy the files into the directory after "host:".
+import shutil, sys
+args = sys.argv[1:]
+paths = []
+while args:
+    arg = args.pop(0)
+    if arg == "-o":
+        args.pop(0)
+    else:
+        paths.append(arg)
+dest = paths.pop().split(":", 1)[1]
+for path in paths:
+    shutil.copy(path, dest)
+"""
+
+STUB_LLAMAFILE = """\
+# Stand-in for the LLaVA llamafile: a tiny /health + /completion server.
+exec {python} - "$@" <<'PY'
+import json, sys, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+port = int(sys.argv[sys.argv.index("--port") + 1])
+
+class Stub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep({delay})
+        body = json.dumps({{"content": "a cat sitting on a keyboard"}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+ThreadingHTTPServer(("127.0.0.1", port), Stub).serve_forever()
+PY
+"""
+
+
+def write_stubs(bindir: Path, convert_delay=0.2, describe_delay=0.1):
+    bindir.mkdir(parents=True, exist_ok=True)
+    stubs = {
+        "pyrocksmith": STUB_PYROCKSMITH.format(
+            python=sys.executable, delay=convert_delay
+        ),
+        "scp": STUB_SCP.format(python=sys.executable),
+        "llamafile": STUB_LLAMAFILE.format(python=sys.executable, delay=describe_delay),
+    }
+    for name, body in stubs.items():
+        path = bindir / name
+        path.write_text(body)
+        path.chmod(0o755)
+    return {name: bindir / name for name in stubs}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the lifetime peak, in KB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Probe:
+    """Collects per-file start/finish times and samples threads and RSS."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = {}
+        self.finished = {}
+        self.done = threading.Condition(self.lock)
+        self.peak_threads = 0
+        self.peak_rss = 0
+        self.sampling = threading.Event()
+
+    def start(self, name):
+        with self.lock:
+            self.started[name] = time.monotonic()
+
+    def wrap(self, handler: FileTypeHandler):
+        """Record when handler.file_handler returns for each file."""
+        original = handler.file_handler
+
+        def timed(path):
+            try:
+                return original(path)
+            finally:
+                with self.done:
+                    self.finished[Path(path).name] = time.monotonic()
+                    self.done.notify_all()
+
+        handler.file_handler = timed
+        return handler
+
+    def wait(self, expected, timeout=TIMEOUT) -> bool:
+        with self.done:
+            return self.done.wait_for(lambda: len(self.finished) >= expected, timeout)
+
+    def sample(self):
+        self.sampling.set()
+        while self.sampling.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+            time.sleep(self.interval)
+
+    def latencies(self):
+        with self.lock:
+            return [
+                self.finished[name] - started
+                for name, started in self.started.items()
+                if name in self.finished
+            ]
+
+
+def write_file(path: Path, size, chunk=64 * 1024, pause=0.0):
+    block = os.urandom(min(chunk, size))
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            n = min(chunk, size - written)
+            f.write(block[:n])
+            f.flush()
+            written += n
+            if pause:
+                time.sleep(pause)
+
+
+class Bench:
+    def __init__(self, root: Path, workers, queue_size, count):
+        self.root = root
+        self.workers = workers
+        self.queue_size = queue_size
+        self.count = count
+        self.stubs = write_stubs(root / "bin")
+        os.environ["PATH"] = f"{root / 'bin'}{os.pathsep}{os.environ['PATH']}"
+
+    def setup(self, name):
+        base = self.root / name
+        watch = base / "watch"
+        out = base / "out"
+        watch.mkdir(parents=True)
+        out.mkdir()
+        return base, watch, out
+
+    def run(self, name):
+        base, watch, out = self.setup(name)
+        probe = Probe()
+        rules, cleanup = getattr(self, f"rules_{name}")(base, out, probe)
+        handler = Handler(
+            router=Router(rules, mode=FIRST),
+            dispatcher=Dispatcher(self.workers, self.queue_size),
+            journal=Journal(base / "journal.db"),
+        )
+        watcher = Watcher(str(watch), handler)
+        runner = threading.Thread(target=watcher.run, name="bench-watcher")
+        sampler = threading.Thread(target=probe.sample, daemon=True)
+        events_before = sum(EVENTS.snapshot().values())
+
+        sampler.start()
+        runner.start()
+        time.sleep(0.5)  # let the observer attach
+        started = time.monotonic()
+        expected = getattr(self, f"load_{name}")(watch, probe)
+        complete = probe.wait(expected)
+        wall = time.monotonic() - started
+        watcher.stop()
+        runner.join()
+        probe.sampling.clear()
+        sampler.join()
+        cleanup()
+
+        events = sum(EVENTS.snapshot().values()) - events_before
+        latencies = probe.latencies()
+        result = {
+            "files": expected,
+            "completed": len(latencies),
+            "timed_out": not complete,
+            "seconds": round(wall, 3),
+            "files_per_second": round(len(latencies) / wall, 2),
+            "events": events,
+            "events_per_second": round(events / wall, 2),
+            "peak_threads": probe.peak_threads,
+            "peak_rss_mb": round(probe.peak_rss / 2**20, 1),
+        }
+        for pct in (50, 90, 99, 100):
+            value = percentile(latencies, pct)
+            key = "max" if pct == 100 else f"p{pct}"
+            result[f"latency_{key}"] = None if value is None else round(value, 4)
+        return result
+
+    # -- hundreds of screenshots at once --------------------------------
+
+    def rules_screenshots(self, base, out, probe):
+        handler = ScreenshotHandler(index=False, dedupe=False)
+        handler.DEST = out
+        return [Rule(probe.wrap(handler), suffixes=IMAGE_SUFFIXES)], lambda: None
+
+    def load_screenshots(self, watch, probe):
+        for n in range(self.count):
+            name = f"shot_{n:05d}.png"
+            write_file(watch / name, 200 * 1024)
+            probe.start(name)
+        return self.count
+
+    # -- large files trickling in ----------------------------------------
+
+    def rules_slow(self, base, out, probe):
+        handler = FileTypeHandler(
+            file_filter=lambda path: True,
+            file_handler=lambda path: shutil.move(path, out / path.name),
+        )
+        return [Rule(probe.wrap(handler), suffixes={".iso"})], lambda: None
+
+    def load_slow(self, watch, probe, files=4, size=16 * 2**20):
+        def writer(n):
+            name = f"image_{n}.iso"
+            write_file(watch / name, size, chunk=256 * 1024, pause=0.02)
+            probe.start(name)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(files)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return files
+
+    # -- psarc conversions, pushed to a fake rocksmithytoo ---------------
+
+    def rules_psarc(self, base, out, probe):
+        remote = base / "remote"
+        remote.mkdir()
+        catalog = Catalog(base / "catalog.db", tiers={"staging": out})
+        handler = PsarcHandler(
+            ConversionScheduler(
+                buildspace=base / "buildspace",
+                pyrocksmith=self.stubs["pyrocksmith"],
+                staging=out,
+                catalog=catalog,
+                cache_dir=base / "cache",
+                failed=base / "failed",
+                journal=None,
+            )
+        )
+        handler.scheduler.sanitize = handler.canonicalize
+        transport = SshTransport(
+            host="bench",
+            remote_dir=f"{remote}/",
+            control_path=base / "ssh-%r@%h:%p",
+        )
+        convert = handler.file_handler
+
+        def convert_and_push(path):
+            result = convert(path)
+            transport.push([p for p in result.outputs if p.name.endswith("_m.psarc")])
+            return result
+
+        handler.file_handler = convert_and_push
+        return [Rule(probe.wrap(handler), suffixes={".psarc"})], lambda: None
+
+    def load_psarc(self, watch, probe):
+        files = max(1, self.count // 10)
+        for n in range(files):
+            name = f"Artist_Song {n}.psarc"
+            write_file(watch / name, 2 * 2**20)
+            probe.start(name)
+        return files
+
+    # -- browser downloads renamed from .part ----------------------------
+
+    def rules_partial(self, base, out, probe):
+        handler = ImageHandler(dedupe=False)
+        handler.DEST = out
+        return [Rule(probe.wrap(handler), suffixes=IMAGE_SUFFIXES)], lambda: None
+
+    def load_partial(self, watch, probe):
+        files = max(1, self.count // 3)
+        for n in range(files):
+            name = f"download_{n:04d}.jpg"
+            write_file(watch / f"{name}.part", 512 * 1024)
+            os.rename(watch / f"{name}.part", watch / name)
+            probe.start(name)
+        return files
+
+    # -- images described by the (stub) LLaVA server ---------------------
+
+    def rules_describe(self, base, out, probe):
+        service = DescriptionService(
+            llamafile=self.stubs["llamafile"], port=free_port()
+        )
+
+        def describe(path):
+            service.describe(path)
+            shutil.move(path, out / path.name)
+
+        handler = FileTypeHandler(file_filter=lambda path: True, file_handler=describe)
+        return [Rule(probe.wrap(handler), suffixes=IMAGE_SUFFIXES)], service.stop
+
+    def load_describe(self, watch, probe):
+        files = max(1, self.count // 10)
+        for n in range(files):
+            name = f"photo_{n:04d}.jpg"
+            write_file(watch / name, 100 * 1024)
+            probe.start(name)
+        return files
+
+
+def version() -> str:
+    try:
+        from importlib.metadata import version as dist_version
+
+        return dist_version("wayward")
+    except Exception:
+        return "unknown"
+
+
+def compare(current, baseline):
+    print(f"\nCompared with {baseline['version']} ({baseline['timestamp']}):")
+    for name, result in current["workloads"].items():
+        old = baseline["workloads"].get(name)
+        if not old:
+            continue
+        changes = []
+        for key in ("latency_p50", "latency_p99", "files_per_second", "peak_rss_mb"):
+            if old.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {result[key] / old[key] - 1:+.0%}")
+        print(f"  {name:12} {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the watcher pipeline against synthetic downloads."
+    )
+    parser.add_argument(
+        "workloads",
+        nargs="*",
+        help=f"Workloads to run: {', '.join(WORKLOADS)} (default: all)",
+    )
+    parser.add_argument("--count", type=int, default=300, help="Screenshots per storm")
+    parser.add_argument("--workers", type=int, default=DISPATCH_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=DISPATCH_QUEUE_SIZE)
+    parser.add_argument("--output", metavar="JSON", help="Where to write results")
+    parser.add_argument("--compare", metavar="JSON", help="Earlier results to diff")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the temp tree for inspection"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            parser.error(f"unknown workload {name!r}")
+    workloads = args.workloads or WORKLOADS
+
+    root = Path(tempfile.mkdtemp(prefix="wayward-bench-"))
+    bench = Bench(root, args.workers, args.queue_size, args.count)
+    results = {
+        "version": version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "count": args.count,
+        "workloads": {},
+    }
+    try:
+        for name in workloads:
+            print(f"Running {name}...", flush=True)
+            result = bench.run(name)
+            results["workloads"][name] = result
+            print(
+                f"  {result['completed']}/{result['files']} files in "
+                f"{result['seconds']}s, p50 {result['latency_p50']}s, "
+                f"p99 {result['latency_p99']}s, {result['events_per_second']} events/s, "
+                f"{result['peak_threads']} threads, {result['peak_rss_mb']} MB"
+            )
+    finally:
+        if args.keep:
+            print(f"Kept {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    output = args.output or f"wayward-bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
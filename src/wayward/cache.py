@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Persistent cache of OCR text and LLaVA descriptions keyed by file content.
+
+Entries are keyed by (sha256 of the file, kind) and stamped with the version
+of whatever produced them, so changing the model or OCR settings invalidates
+old results on read. The SQLite store is bounded by ``CACHE_MAX_BYTES`` with
+least-recently-used eviction, and a small in-memory LRU in front of it
+answers repeats without touching disk.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from wayward.config import (
+    CACHE_DB,
+    CACHE_MAX_BYTES,
+    CACHE_MEMORY_ENTRIES,
+    IMAGE_SUFFIXES,
+)
+
+logger = logging.getLogger(__name__)
+
+OCR = "ocr"
+DESCRIPTION = "description"
+
+CHUNK = 1024 * 1024
+
+
+def hash_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    def __init__(
+        self,
+        path=CACHE_DB,
+        max_bytes=CACHE_MAX_BYTES,
+        memory_entries=CACHE_MEMORY_ENTRIES,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS entries (
+                hash TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                version TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (hash, kind)
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+            """
+        )
+
+    def get(self, digest, kind, version):
+        """Return the cached value, or None on a miss or version mismatch."""
+        key = (digest, kind)
+        with self.lock:
+            hit = self.memory.get(key)
+            if hit is not None and hit[0] == version:
+                self.memory.move_to_end(key)
+                return hit[1]
+
+            row = self.db.execute(
+                "SELECT version, value FROM entries WHERE hash = ? AND kind = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] != version:
+                self.db.execute("DELETE FROM entries WHERE hash = ? AND kind = ?", key)
+                self.db.commit()
+                return None
+            self.db.execute(
+                "UPDATE entries SET accessed = ? WHERE hash = ? AND kind = ?",
+                (time.time(), *key),
+            )
+            self.db.commit()
+            self._remember(key, row[0], row[1])
+            return row[1]
+
+    def put(self, digest, kind, version, value):
+        size = len(digest) + len(kind) + len(version) + len(value.encode())
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, kind, version, value, size, time.time()),
+            )
+            self._evict()
+            self.db.commit()
+            self._remember((digest, kind), version, value)
+
+    def stats(self) -> dict:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY kind"
+            ).fetchall()
+        return {kind: {"entries": n, "bytes": size} for kind, n, size in rows}
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM entries")
+            self.db.commit()
+            self.memory.clear()
+
+    def _remember(self, key, version, value):
+        self.memory[key] = (version, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so eviction doesn't run on every subsequent put.
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for digest, kind, size in self.db.execute(
+            "SELECT hash, kind, size FROM entries ORDER BY accessed"
+        ):
+            victims.append((digest, kind))
+            freed += size
+            if freed >= target:
+                break
+        self.db.executemany("DELETE FROM entries WHERE hash = ? AND kind = ?", victims)
+        for key in victims:
+            self.memory.pop(key, None)
+        logger.info(f"Evicted {len(victims)} cache entries ({freed} bytes)")
+
+
+class CachedDescriber:
+    """DescriptionService front that answers repeat images from the cache."""
+
+    def __init__(self, service, cache):
+        self.service = service
+        self.cache = cache
+
+    def describe(self, path) -> str:
+        digest = hash_file(path)
+        version = self.service.version
+        description = self.cache.get(digest, DESCRIPTION, version)
+        if description is None:
+            description = self.service.describe(path)
+            # The filename is derived from this, so it isn't cached itself.
+            self.cache.put(digest, DESCRIPTION, version, description)
+        else:
+            logger.info(f"Description cache hit for {path}")
+        return description
+
+
+def cached_ocr(pool, cache, path) -> str:
+    """OCR path through the pool unless its content was seen before."""
+    digest = hash_file(path)
+    text = cache.get(digest, OCR, pool.version)
+    if text is not None:
+        logger.info(f"OCR cache hit for {path}")
+        return text
+    result = pool.ocr(path)
+    if result.error:
+        raise RuntimeError(f"OCR failed for {path}: {result.error}")
+    cache.put(digest, OCR, pool.version, result.text)
+    return result.text
+
+
+def backfill(paths, cache, ocr=True, describe=False):
+    """Populate the cache for many images; OCR runs in parallel on the pool."""
+    from wayward.ocr import get_pool
+
+    paths = [str(p) for p in paths]
+    digests = {path: hash_file(path) for path in paths}
+    done = 0
+    if ocr:
+        pool = get_pool()
+        todo = [p for p in paths if cache.get(digests[p], OCR, pool.version) is None]
+        for result in pool.map(todo):
+            if result.error:
+                logger.error(f"OCR failed for {result.path}: {result.error}")
+                continue
+            cache.put(digests[result.path], OCR, pool.version, result.text)
+            done += 1
+    if describe:
+        from wayward.describe import get_service
+
+        describer = CachedDescriber(get_service(), cache)
+        for path in paths:
+            try:
+                describer.describe(path)
+                done += 1
+            except RuntimeError as e:
+                logger.error(f"Description failed for {path}: {e}")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the OCR/description cache.")
+    parser.add_argument("--backfill", metavar="DIR", help="Cache every image in DIR")
+    parser.add_argument(
+        "--describe",
+        action="store_true",
+        help="With --backfill, also generate LLaVA descriptions",
+    )
+    parser.add_argument("--stats", action="store_true", help="Show cache size")
+    parser.add_argument("--clear", action="store_true", help="Drop every entry")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    cache = ContentCache()
+    if args.clear:
+        cache.clear()
+        print("Cache cleared.")
+    elif args.backfill:
+        paths = [
+            entry.path
+            for entry in os.scandir(args.backfill)
+            if entry.is_file() and Path(entry.name).suffix.lower() in IMAGE_SUFFIXES
+        ]
+        print(f"Backfilling {len(paths)} images from {args.backfill}...")
+        done = backfill(paths, cache, describe=args.describe)
+        print(f"Cached {done} new results.")
+    elif args.stats:
+        for kind, stats in cache.stats().items():
+            print(f"{kind}: {stats['entries']} entries, {stats['bytes']} bytes")
+    else:
+        parser.print_help()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ContentCache:
+    """Return the process-wide content cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ContentCache()
+        return _cache
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""SQLite index of the CDLC library so lookups don't walk NFS.
+
+One row per psarc with its tier (staging, live, quarantine), size, mtime,
+content hash (when known) and the ``_m``/``_p`` pair it belongs to. Wayward
+records its own moves here as they happen. ``refresh`` reconciles changes
+made behind its back: it stats each tier directory and only re-reads the
+ones whose mtime changed (or every one, with ``force``). A re-read stats each
+file in it, so a file replaced in place gets its new size and mtime, and
+loses a hash that no longer describes it.
+
+Song metadata read from each archive's manifests is cached alongside, valid
+while the file's size and mtime are unchanged. It also remembers every
+conversion by the sha256 of the downloaded psarc, so a repeat download can be
+matched to the outputs it produced last time.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from wayward.config import CATALOG_DB, TIERS
+from wayward.psarc import SongInfo, read_metadata
+
+logger = logging.getLogger(__name__)
+
+# Where a pushed file sits on rocksmithytoo: the DLC dir Rocksmith scans, or
+# the holding dir quarantined files are parked in.
+REMOTE_DLC_TIER = "dlc"
+REMOTE_HELD_TIER = "disabled"
+
+
+class Entry(NamedTuple):
+    tier: str
+    name: str
+    size: int
+    mtime_ns: int
+    hash: Optional[str]
+    pair: str
+
+
+class Pushed(NamedTuple):
+    name: str
+    size: int
+    mtime_ns: int
+    hash: Optional[str]
+    tier: str = REMOTE_DLC_TIER
+
+
+class Conversion(NamedTuple):
+    hash: str
+    source: str
+    outputs: List[str]
+    converted: float
+
+
+def pair_key(name: str) -> str:
+    """Song_v1_m.psarc and Song_v1_p.psarc share the key Song_v1."""
+    for suffix in ("_m.psarc", "_p.psarc"):
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return Path(name).stem
+
+
+def tagged(name: str, tag: str) -> str:
+    """Song_v1_m.psarc tagged with abc is Song_v1_abc_m.psarc, still paired."""
+    key = pair_key(name)
+    return f"{key}_{tag}{name[len(key) :]}"
+
+
+class Catalog:
+    def __init__(self, path=CATALOG_DB, tiers=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tiers = {k: Path(v) for k, v in (tiers or TIERS).items()}
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS files (
+                tier TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT,
+                pair TEXT NOT NULL,
+                PRIMARY KEY (tier, name)
+            );
+            CREATE INDEX IF NOT EXISTS files_name ON files (name);
+            CREATE INDEX IF NOT EXISTS files_pair ON files (pair);
+            CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+            CREATE TABLE IF NOT EXISTS dirs (
+                tier TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL
+            );
+            -- What wayward has pushed to rocksmithytoo, as of the push.
+            CREATE TABLE IF NOT EXISTS remote (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT,
+                tier TEXT NOT NULL DEFAULT 'dlc'
+            );
+            -- Downloaded psarc content => the files pyrocksmith made from it.
+            CREATE TABLE IF NOT EXISTS conversions (
+                hash TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                converted REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS songs (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                artist TEXT NOT NULL,
+                title TEXT NOT NULL,
+                album TEXT NOT NULL,
+                year INTEGER,
+                arrangements TEXT NOT NULL,
+                tuning TEXT NOT NULL
+            );
+            """
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(remote)")}
+        if "tier" not in columns:
+            # Catalogs from before the remote holding dir.
+            self.db.execute(
+                "ALTER TABLE remote ADD COLUMN tier TEXT NOT NULL DEFAULT 'dlc'"
+            )
+            self.db.commit()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            try:
+                yield self.db
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+
+    def refresh(self, force=False) -> int:
+        """Reconcile tiers whose directory changed; return rows touched."""
+        touched = 0
+        for tier, dirpath in self.tiers.items():
+            try:
+                mtime_ns = dirpath.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+            with self.transaction() as db:
+                row = db.execute(
+                    "SELECT mtime_ns FROM dirs WHERE tier = ?", (tier,)
+                ).fetchone()
+                if row and row[0] == mtime_ns and not force:
+                    continue
+                touched += self._rescan(db, tier, dirpath)
+                db.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?)", (tier, mtime_ns)
+                )
+        if touched:
+            logger.info(f"Catalog refresh updated {touched} entries")
+        return touched
+
+    def list(self, tier):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM files WHERE tier = ? ORDER BY name", (tier,)
+            ).fetchall()
+        return [Entry(*row) for row in rows]
+
+    def locate(self, name, tiers=None) -> Optional[str]:
+        """Return the tier holding name, checking tiers in the given order."""
+        with self.lock:
+            found = {
+                row[0]
+                for row in self.db.execute(
+                    "SELECT tier FROM files WHERE name = ?", (name,)
+                )
+            }
+        for tier in tiers or self.tiers:
+            if tier in found:
+                return tier
+        return None
+
+    def get(self, tier, name) -> Optional[Entry]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM files WHERE tier = ? AND name = ?", (tier, name)
+            ).fetchone()
+        return Entry(*row) if row else None
+
+    def by_hash(self, digest):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM files WHERE hash = ?", (digest,)
+            ).fetchall()
+        return [Entry(*row) for row in rows]
+
+    def record_add(self, tier, path, digest=None):
+        path = Path(path)
+        st = path.stat()
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    tier,
+                    path.name,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    digest,
+                    pair_key(path.name),
+                ),
+            )
+
+    def record_move(self, name, src_tier, dst_tier):
+        with self.transaction() as db:
+            db.execute(
+                "DELETE FROM files WHERE tier = ? AND name = ?", (dst_tier, name)
+            )
+            moved = db.execute(
+                "UPDATE files SET tier = ? WHERE tier = ? AND name = ?",
+                (dst_tier, src_tier, name),
+            ).rowcount
+        if not moved:
+            self.record_add(dst_tier, self.tiers[dst_tier] / name)
+
+    def record_remove(self, tier, name):
+        with self.transaction() as db:
+            db.execute("DELETE FROM files WHERE tier = ? AND name = ?", (tier, name))
+
+    def set_hash(self, tier, name, digest):
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE files SET hash = ? WHERE tier = ? AND name = ?",
+                (digest, tier, name),
+            )
+
+    def manifest(self, tier=REMOTE_DLC_TIER) -> dict:
+        """Return {name: Pushed} for what we pushed that now sits in tier."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM remote WHERE tier = ?", (tier,)
+            ).fetchall()
+        return {row[0]: Pushed(*row) for row in rows}
+
+    def record_remote_move(self, names, tier):
+        """Note that names were renamed into tier on rocksmithytoo."""
+        with self.transaction() as db:
+            db.executemany(
+                "UPDATE remote SET tier = ? WHERE name = ?",
+                [(tier, name) for name in names],
+            )
+
+    def record_pushed(self, names, hashes=None):
+        """Note that live/ copies of names now exist remotely."""
+        hashes = hashes or {}
+        with self.transaction() as db:
+            for name in names:
+                entry = self.get("live", name)
+                if entry is None:
+                    continue
+                db.execute(
+                    "INSERT OR REPLACE INTO remote VALUES (?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        entry.size,
+                        entry.mtime_ns,
+                        hashes.get(name) or entry.hash,
+                        REMOTE_DLC_TIER,
+                    ),
+                )
+
+    def song(self, tier, name) -> Optional[SongInfo]:
+        """Metadata for a cataloged psarc, read from the archive on a miss."""
+        entry = self.get(tier, name)
+        if entry is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM songs WHERE name = ? AND size = ? AND mtime_ns = ?",
+                (name, entry.size, entry.mtime_ns),
+            ).fetchone()
+        if row is not None:
+            return SongInfo(*row[3:7], tuple(row[7].split("\n")), row[8])
+        info = read_metadata(self.tiers[tier] / name)
+        if info is not None:
+            with self.transaction() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        entry.size,
+                        entry.mtime_ns,
+                        info.artist,
+                        info.title,
+                        info.album,
+                        info.year,
+                        "\n".join(info.arrangements),
+                        info.tuning,
+                    ),
+                )
+        return info
+
+    def record_conversion(self, digest, source, outputs):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?)",
+                (digest, source, "\n".join(outputs), time.time()),
+            )
+
+    def conversion(self, digest) -> Optional[Conversion]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM conversions WHERE hash = ?", (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        return Conversion(row[0], row[1], row[2].split("\n"), row[3])
+
+    def forget_remote(self, names):
+        with self.transaction() as db:
+            db.executemany(
+                "DELETE FROM remote WHERE name = ?", [(name,) for name in names]
+            )
+
+    def _rescan(self, db, tier, dirpath) -> int:
+        known = {
+            row[0]: (row[1], row[2])
+            for row in db.execute(
+                "SELECT name, size, mtime_ns FROM files WHERE tier = ?", (tier,)
+            )
+        }
+        present = set()
+        added = 0
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".psarc"):
+                    continue
+                present.add(entry.name)
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name in known:
+                    if known[entry.name] != (st.st_size, st.st_mtime_ns):
+                        # Replaced behind our back: the old hash is wrong now.
+                        db.execute(
+                            "UPDATE files SET size = ?, mtime_ns = ?, hash = NULL "
+                            "WHERE tier = ? AND name = ?",
+                            (st.st_size, st.st_mtime_ns, tier, entry.name),
+                        )
+                        added += 1
+                    continue
+                db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, NULL, ?)",
+                    (
+                        tier,
+                        entry.name,
+                        st.st_size,
+                        st.st_mtime_ns,
+                        pair_key(entry.name),
+                    ),
+                )
+                added += 1
+        gone = known.keys() - present
+        db.executemany(
+            "DELETE FROM files WHERE tier = ? AND name = ?",
+            [(tier, name) for name in gone],
+        )
+        return added + len(gone)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> Catalog:
+    """Return the process-wide catalog, refreshed on first use."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog()
+            _catalog.refresh()
+        return _catalog
@@ -0,0 +1,124 @@
+"""Fold the event stream for one file into a single job.
+
+Watchdog reports a download as ``created`` followed by a burst of ``modified``
+(and on Linux ``closed``) events. Each path moves through two states: pending
+while it stabilizes, active while handlers run. Events for a pending path are
+collapsed into the job already waiting; events for an active path are dropped,
+since they are usually the handler's own move racing the watcher. Paths are
+also indexed by inode so renaming a pending file (say ``draft.tmp`` →
+``draft.txt``) keeps the same job instead of starting another.
+"""
+
+import logging
+import os
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+NEW = "new"
+PENDING = "pending"
+ACTIVE = "active"
+RENAMED = "renamed"
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+class Coalescer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.active = {}
+        self.inodes = {}
+        self.counts = Counter()
+
+    def offer(self, path):
+        """Classify an event for path.
+
+        Returns ``(status, previous)``: NEW means start a job, PENDING and
+        ACTIVE mean the event was folded into or dropped for an existing one,
+        RENAMED means a pending job under ``previous`` now lives at path.
+        """
+        with self.lock:
+            self.counts["received"] += 1
+            if path in self.active:
+                self.counts["dropped"] += 1
+                return ACTIVE, None
+            if path in self.pending:
+                self.counts["collapsed"] += 1
+                return PENDING, None
+
+            ino = _inode(path)
+            previous = self.inodes.get(ino) if ino is not None else None
+            if previous is not None and previous in self.pending:
+                self._rekey(previous, path, ino)
+                return RENAMED, previous
+            if previous is not None and previous in self.active:
+                self.counts["dropped"] += 1
+                return ACTIVE, None
+
+            self.pending[path] = ino
+            if ino is not None:
+                self.inodes[ino] = path
+            self.counts["admitted"] += 1
+            return NEW, None
+
+    def rename(self, src, dest) -> bool:
+        """Follow a pending job across a rename; True if src was pending."""
+        with self.lock:
+            if src not in self.pending:
+                return False
+            self._rekey(src, dest, _inode(dest))
+            return True
+
+    def activate(self, path) -> bool:
+        """Move path from pending to active; False if it is no longer pending."""
+        with self.lock:
+            if path not in self.pending:
+                return False
+            self.active[path] = self.pending.pop(path)
+            return True
+
+    def deactivate(self, path):
+        """Move path from active back to pending, e.g. when it must wait."""
+        with self.lock:
+            if path in self.active:
+                self.pending[path] = self.active.pop(path)
+
+    def discard(self, path):
+        """Forget a pending or active path, e.g. when it vanished or finished."""
+        with self.lock:
+            ino = self.pending.pop(path, None)
+            if ino is None:
+                ino = self.active.pop(path, None)
+            if ino is not None and self.inodes.get(ino) == path:
+                del self.inodes[ino]
+
+    release = discard
+
+    def is_tracked(self, path) -> bool:
+        with self.lock:
+            return path in self.pending or path in self.active
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(
+                self.counts,
+                pending=len(self.pending),
+                active=len(self.active),
+            )
+
+    def _rekey(self, old, new, ino):
+        old_ino = self.pending.pop(old)
+        if old_ino is not None and self.inodes.get(old_ino) == old:
+            del self.inodes[old_ino]
+        self.pending[new] = ino
+        if ino is not None:
+            self.inodes[ino] = new
+        self.counts["renamed"] += 1
+        logger.debug(f"Following rename {old} => {new}")
@@ -1,11 +1,130 @@
-"""Shared paths and constants for wayward CDLC management."""
+"""Shared paths and constants for wayward."""
 
+import os
 from pathlib import Path
 
 CDLC_ROOT = Path("/home/ahonnecke/nasty/music/Rocksmith_CDLC")
 STAGING = CDLC_ROOT / "staging"
 LIVE = CDLC_ROOT / "live"
 QUARANTINE = CDLC_ROOT / "quarantine"
+TIERS = {"staging": STAGING, "live": LIVE, "quarantine": QUARANTINE}
 
 REMOTE_HOST = "ahonnecke@rocksmithytoo"
 REMOTE_DLC = "~/Library/Application Support/Steam/steamapps/common/Rocksmith2014/dlc/"
+# Quarantined files are parked here, outside the dlc/ tree Rocksmith scans.
+REMOTE_DISABLED = (
+    "~/Library/Application Support/Steam/steamapps/common/Rocksmith2014/dlc_disabled/"
+)
+# One multiplexed SSH connection is shared by every remote operation.
+REMOTE_CONTROL_PATH = Path("/home/ahonnecke/.ssh/wayward-%r@%h:%p")
+REMOTE_CONTROL_PERSIST = "10m"
+# rocksmithytoo is a Mac: BSD stat prints "<size> <name>" with this format.
+REMOTE_STAT = "stat -f '%z %N'"
+# Point remote operations at a local directory instead (testing).
+REMOTE_LOCAL_DIR = os.environ.get("WAYWARD_REMOTE_DIR")
+
+IMAGE_SUFFIXES = frozenset({".png", ".jpg", ".jpeg", ".tiff", ".bmp", ".gif"})
+
+# Watching: the share of the per-user inotify limits wayward may use, and
+# how often roots on network filesystems (where inotify sees nothing) are polled
+INOTIFY_SHARE = 0.5
+POLL_INTERVAL = 5
+NETWORK_FILESYSTEMS = frozenset(
+    {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "fuse.sshfs"}
+)
+
+# Daemon job dispatch
+DISPATCH_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+DISPATCH_QUEUE_SIZE = 256
+# Seconds a stable file refused by a full lane waits before it is offered again.
+DISPATCH_RETRY = 1.0
+
+# File stabilization (seconds)
+STABILIZE_SETTLE = 1.0
+STABILIZE_CLOSED_DELAY = 0.05
+STABILIZE_MAX_DELAY = 16.0
+
+# Resident LLaVA description server
+LLAVA = Path("/home/ahonnecke/local/bin/llava-v1.5-7b-q4.llamafile")
+LLAVA_HOST = "127.0.0.1"
+LLAVA_PORT = 8765
+LLAVA_PARALLEL = 2
+LLAVA_BATCH_WAIT = 0.05
+LLAVA_STARTUP_TIMEOUT = 120
+LLAVA_REQUEST_TIMEOUT = 120
+
+# In-process OCR pool
+OCR_WORKERS = os.cpu_count() or 1
+OCR_TIMEOUT = 30
+OCR_GRAYSCALE = True
+OCR_MAX_DIMENSION = 4000
+
+# Cross-filesystem moves (NAS ingest): read/write size per syscall
+MOVE_BUFFER = 8 * 1024 * 1024
+
+# Daemon log: written by a background thread, rotated at LOG_MAX_BYTES (or
+# on LOG_ROTATE_WHEN, e.g. "midnight") and gzipped. LOG_FORMAT "json" writes
+# JSON lines with job, handler, path, bytes and timings.
+LOG_FILE = Path("/tmp/wayward.log")
+LOG_FORMAT = "text"
+LOG_MAX_BYTES = 16 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_ROTATE_WHEN = None
+
+# Metrics endpoint (localhost only; 0 disables) and SIGUSR1 snapshot
+METRICS_PORT = 9477
+METRICS_DUMP = Path("/tmp/wayward-metrics.json")
+
+# Local state (SQLite databases, caches); keep off NFS
+STATE_DIR = Path("/home/ahonnecke/.cache/wayward")
+
+# Single-instance lock and the daemon's control socket (wayward-ctl)
+LOCK_FILE = STATE_DIR / "wayward.pid"
+CONTROL_SOCKET = STATE_DIR / "wayward.sock"
+
+# Stage journal of in-flight jobs, resumed after a crash or restart
+JOURNAL_DB = STATE_DIR / "journal.db"
+JOURNAL_KEEP = 7 * 24 * 3600
+
+# Content-hash cache for OCR text and LLaVA descriptions
+CACHE_DB = STATE_DIR / "content.db"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_MEMORY_ENTRIES = 1024
+OCR_CACHE_VERSION = "tesseract-1"
+
+# Full-text index of screenshot OCR text and image descriptions
+SEARCH_DB = STATE_DIR / "search.db"
+SCREENSHOTS = Path("/home/ahonnecke/screenshots")
+SEARCH_ROOTS = (SCREENSHOTS, Path("/home/ahonnecke/Downloads/images"))
+# OCR each screenshot as it is filed, so it shows up in wayward-search
+INDEX_SCREENSHOTS = True
+
+# Perceptual-hash near-duplicate detection for incoming images: at most
+# PHASH_DISTANCE of 64 dHash bits differ. PHASH_ACTION is "flag" (log and
+# record), "link" (file it as a hard link to the original) or "skip" (park it
+# in PHASH_DUPLICATES instead of filing it).
+PHASH_DB = STATE_DIR / "phash.db"
+PHASH_DISTANCE = 6
+PHASH_ACTION = "flag"
+PHASH_DUPLICATES = Path("/home/ahonnecke/Downloads/images/duplicates")
+
+# Index of every psarc in staging/live/quarantine
+CATALOG_DB = STATE_DIR / "catalog.db"
+
+# CDLC conversion
+BUILDSPACE = Path("/home/ahonnecke/cdlc_buildspace")
+PYROCKSMITH = Path("/home/ahonnecke/.pyenv/shims/pyrocksmith")
+# Downloads whose conversion failed, kept for a look (not watched)
+CONVERT_FAILED = Path("/home/ahonnecke/Downloads/failed")
+CONVERT_WORKERS = os.cpu_count() or 1
+# pyrocksmith outputs kept by input hash, so a re-download skips conversion
+CONVERT_CACHE = STATE_DIR / "converted"
+CONVERT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Dispatch lanes (see dispatch.py): lane => (workers, nice, idle I/O class).
+# The fast lane's workers come from --workers / DISPATCH_WORKERS.
+LANES = {
+    "fast": (DISPATCH_WORKERS, 0, False),
+    "convert": (CONVERT_WORKERS, 10, True),
+    "inference": (LLAVA_PARALLEL, 5, False),
+}
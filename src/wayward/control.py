@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Unix control socket for the running daemon, and the ``wayward-ctl`` client.
+
+Each connection sends one JSON request line, ``{"command": ..., "args": [...]}``,
+and gets one JSON reply line back. The socket lives at ``CONTROL_SOCKET`` and
+is only accessible to its owner.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+
+from wayward.config import CONTROL_SOCKET
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ("status", "enqueue", "pause", "resume", "drain", "reload-handlers")
+
+
+class ControlError(RuntimeError):
+    pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            reply = self.server.control.execute(
+                request.get("command"), request.get("args") or []
+            )
+        except Exception as e:
+            logger.error(f"Control request failed: {e}")
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class ControlServer:
+    """Serve control commands against a running Handler."""
+
+    def __init__(self, handler, reload=None, path=CONTROL_SOCKET):
+        self.handler = handler
+        self.reload = reload
+        self.path = Path(path)
+        self.server = None
+        self.started = time.time()
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Only the lock holder gets here, so any existing socket is stale.
+        self.path.unlink(missing_ok=True)
+        self.server = _Server(str(self.path), _RequestHandler)
+        self.server.control = self
+        os.chmod(self.path, 0o600)
+        threading.Thread(
+            target=self.server.serve_forever, name="wayward-control", daemon=True
+        ).start()
+        logger.info(f"Control socket listening at {self.path}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.path.unlink(missing_ok=True)
+
+    def execute(self, command, args) -> dict:
+        method = {
+            "status": self.status,
+            "enqueue": self.enqueue,
+            "pause": self.pause,
+            "resume": self.resume,
+            "drain": self.drain,
+            "reload-handlers": self.reload_handlers,
+        }.get(command)
+        if method is None:
+            return {"ok": False, "error": f"unknown command {command!r}"}
+        logger.info(f"Control: {command} {' '.join(map(str, args))}".rstrip())
+        return {"ok": True, **method(*args)}
+
+    def status(self) -> dict:
+        handler = self.handler
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "paused": handler.dispatcher.paused,
+            "workers": handler.dispatcher.workers,
+            "queued": handler.dispatcher.depth(),
+            "lanes": handler.dispatcher.stats(),
+            "stabilizing": len(handler.stabilizer),
+            "coalescer": handler.coalescer.stats(),
+            "journaled": len(handler.journal.unfinished()),
+            "roots": [str(root.path) for root in handler.roots],
+            "handlers": [str(h) for h in handler.handlers],
+        }
+
+    def enqueue(self, *paths) -> dict:
+        queued = [path for path in paths if self.handler.enqueue(path)]
+        skipped = [path for path in paths if path not in queued]
+        return {"queued": queued, "skipped": skipped}
+
+    def pause(self) -> dict:
+        self.handler.dispatcher.pause()
+        return {"paused": True}
+
+    def resume(self) -> dict:
+        self.handler.dispatcher.resume()
+        return {"paused": False}
+
+    def drain(self, timeout=300) -> dict:
+        return {"drained": self.handler.dispatcher.drain(float(timeout))}
+
+    def reload_handlers(self) -> dict:
+        if self.reload is None:
+            return {"ok": False, "error": "no handler factory to reload from"}
+        self.handler.reload(self.reload())
+        return {"handlers": [str(h) for h in self.handler.handlers]}
+
+
+def request(command, *args, path=CONTROL_SOCKET, timeout=None) -> dict:
+    """Send one command to the daemon and return its reply."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(path))
+            sock.sendall(
+                json.dumps({"command": command, "args": list(args)}).encode() + b"\n"
+            )
+            with sock.makefile("rb") as f:
+                line = f.readline()
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        raise ControlError(f"wayward daemon is not running ({e})")
+    if not line:
+        raise ControlError("daemon closed the connection without replying")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control the running wayward daemon.")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("paths", nargs="*", help="Files to queue (enqueue)")
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="Seconds to wait for drain"
+    )
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        if not args.paths:
+            parser.error("enqueue needs at least one path")
+        call = ("enqueue", *[str(Path(p).resolve()) for p in args.paths])
+    elif args.command == "drain":
+        call = ("drain", args.timeout)
+    else:
+        call = (args.command,)
+
+    try:
+        reply = request(*call)
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    if not reply.pop("ok", False):
+        print(f"error: {reply.get('error')}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(reply, indent=2))
+
+
+if __name__ == "__main__":
+    main()
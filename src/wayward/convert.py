@@ -0,0 +1,345 @@
+"""Run pyrocksmith conversions in parallel, each in its own workspace.
+
+Every job gets a private directory under ``BUILDSPACE`` so concurrent
+conversions can't sweep up each other's outputs. At most ``CONVERT_WORKERS``
+pyrocksmith processes run at once; extra jobs wait for a slot.
+
+Before converting, the download is hashed once and looked up in the catalog.
+Content already in staging/live is dropped as a duplicate, content whose
+files were quarantined is rejected, and when only the outputs are missing
+from the library they are restored from ``CONVERT_CACHE`` instead of running
+pyrocksmith again.
+
+With a journal, each job logs its stages (in the workspace, converted,
+published) and a job replayed after a crash picks up after the last one it
+finished. Every stage is safe to repeat: the move resumes, pyrocksmith just
+runs again and outputs already in staging are left there. A job that fails
+moves its download to ``CONVERT_FAILED`` and drops its workspace, so nothing
+is left stranded in ``BUILDSPACE``.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from wayward.cache import hash_file
+from wayward import journal
+from wayward.catalog import get_catalog, tagged
+from wayward.config import (
+    BUILDSPACE,
+    CONVERT_CACHE,
+    CONVERT_CACHE_MAX_BYTES,
+    CONVERT_FAILED,
+    CONVERT_WORKERS,
+    PYROCKSMITH,
+    STAGING,
+)
+from wayward.metrics import SUBPROCESS_FAILURES, SUBPROCESS_SECONDS
+from wayward.mover import move
+
+logger = logging.getLogger(__name__)
+
+CONVERTED = "converted"
+REUSED = "reused"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+# What pyrocksmith leaves in a workspace: the Mac (_m) and PC (_p) psarcs. A
+# download named otherwise is the input, not an output.
+OUTPUTS = "*_[mp].psarc"
+
+
+class ConversionResult(NamedTuple):
+    job_id: str
+    source: Path
+    outputs: List[Path]
+    seconds: float
+    convert_seconds: float
+    status: str = CONVERTED
+    hash: Optional[str] = None
+
+
+def new_job_id() -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+class ConversionScheduler:
+    def __init__(
+        self,
+        buildspace=BUILDSPACE,
+        pyrocksmith=PYROCKSMITH,
+        staging=STAGING,
+        workers=CONVERT_WORKERS,
+        sanitize=None,
+        catalog=None,
+        cache_dir=CONVERT_CACHE,
+        cache_max_bytes=CONVERT_CACHE_MAX_BYTES,
+        journal=None,
+        failed=CONVERT_FAILED,
+    ):
+        self.buildspace = Path(buildspace)
+        self.pyrocksmith = Path(pyrocksmith)
+        self.staging = Path(staging)
+        self.sanitize = sanitize
+        self.catalog = catalog
+        self.cache_dir = Path(cache_dir)
+        self.cache_max_bytes = cache_max_bytes
+        self.journal = journal
+        self.failed = Path(failed)
+        self.cache_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def workspace(self, job_id) -> Path:
+        return self.buildspace / job_id
+
+    def outputs(self, job_id) -> List[Path]:
+        """The _m/_p psarcs in job_id's workspace."""
+        return sorted(self.workspace(job_id).glob(OUTPUTS))
+
+    def get_catalog(self):
+        return self.catalog or get_catalog()
+
+    def convert(self, path, job_id: Optional[str] = None) -> ConversionResult:
+        """Convert one psarc and publish the results to staging; blocks for a slot.
+
+        If the journal has an open job for path, continue that job from the
+        last stage it completed.
+        """
+        job = self.journal.find(path) if self.journal is not None else None
+        if job is not None:
+            job_id = job.job_id
+        job_id = job_id or new_job_id()
+        started = time.monotonic()
+
+        if journal.reached(job, journal.BUILDSPACE):
+            source, digest = Path(job.path), job.detail["hash"]
+        else:
+            source, digest = self.prepare(path, job_id)
+            job = self.checkpoint(job, journal.BUILDSPACE, source, hash=digest)
+
+        try:
+            return self._convert(job, job_id, source, digest, started)
+        except Exception:
+            self.fail(job_id, source)
+            raise
+
+    def _convert(self, job, job_id, source, digest, started) -> ConversionResult:
+        convert_seconds = 0.0
+        if journal.reached(job, journal.CONVERTED):
+            status, names = job.detail["status"], job.detail["outputs"]
+            logger.info(f"Resuming {source.name} at publish [{job_id}]")
+        else:
+            status = self.known(digest)
+            if status is not None:
+                shutil.rmtree(self.workspace(job_id))
+                return ConversionResult(
+                    job_id, source, [], time.monotonic() - started, 0.0, status, digest
+                )
+
+            status = REUSED if self.restore_cached(digest, job_id) else CONVERTED
+            if status == CONVERTED:
+                with self.slots:
+                    convert_started = time.monotonic()
+                    self.run_pyrocksmith(source)
+                    convert_seconds = time.monotonic() - convert_started
+                self.store_cached(digest, job_id)
+            names = [path.name for path in self.outputs(job_id)]
+            job = self.checkpoint(
+                job, journal.CONVERTED, source, status=status, outputs=names
+            )
+
+        outputs = self.publish(job_id, names, digest)
+        self.get_catalog().record_conversion(
+            digest, source.name, [output.name for output in outputs]
+        )
+        self.checkpoint(job, journal.PUBLISHED, source)
+        seconds = time.monotonic() - started
+        if status == REUSED:
+            logger.info(f"Reused cached conversion of {source.name} [{job_id}]")
+        else:
+            logger.info(
+                f"Converted {source.name} in {seconds:.1f}s "
+                f"(pyrocksmith {convert_seconds:.1f}s) [{job_id}]"
+            )
+        return ConversionResult(
+            job_id, source, outputs, seconds, convert_seconds, status, digest
+        )
+
+    def fail(self, job_id, source):
+        """Move a failed job's download to the failed dir, drop its workspace."""
+        if source.exists():
+            self.failed.mkdir(parents=True, exist_ok=True)
+            kept = move(source, self.failed / source.name).dest
+            logger.error(f"Conversion of {source.name} failed, moved it to {kept}")
+        shutil.rmtree(self.workspace(job_id), ignore_errors=True)
+
+    def checkpoint(self, job, stage, path, **detail):
+        """Journal that job finished stage; a no-op for unjournaled jobs."""
+        if job is None:
+            return None
+        return self.journal.record(job.job_id, stage, path, **detail)
+
+    def known(self, digest) -> Optional[str]:
+        """DUPLICATE or REJECTED if this content is already in the library."""
+        catalog = self.get_catalog()
+        tiers = {entry.tier: entry.name for entry in catalog.by_hash(digest)}
+        previous = catalog.conversion(digest)
+        if previous is not None:
+            for name in previous.outputs:
+                tier = catalog.locate(name, ["quarantine", "live", "staging"])
+                if tier is not None:
+                    tiers.setdefault(tier, name)
+
+        if "quarantine" in tiers:
+            logger.warning(
+                f"Rejected download: same content as quarantined {tiers['quarantine']}"
+            )
+            return REJECTED
+        for tier in ("live", "staging"):
+            if tier in tiers:
+                logger.info(f"Skipped download: same content as {tier}/{tiers[tier]}")
+                return DUPLICATE
+        return None
+
+    def prepare(self, path, job_id):
+        """Move the download into a fresh workspace and sanitize its name.
+
+        Returns the new path and the content hash, taken during the move if
+        it had to copy, otherwise in one pass afterwards. If the download is
+        already gone, a resumed job finds it in the workspace instead.
+        """
+        path = Path(path)
+        workspace = self.workspace(job_id)
+        workspace.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            source = workspace / path.name
+            moved = move(path, source)
+            digest = moved.hash or hash_file(source)
+        else:
+            found = sorted(workspace.glob("*.psarc"))
+            if not found:
+                raise RuntimeError(f"{path} is gone and workspace {workspace} is empty")
+            source = found[0]
+            digest = hash_file(source)
+        if self.sanitize and (sanitized := self.sanitize(source)):
+            source = sanitized
+        return source, digest
+
+    def restore_cached(self, digest, job_id) -> bool:
+        """Put cached outputs for digest into the workspace, if we have them."""
+        cached = self.cache_dir / digest
+        with self.cache_lock:
+            if not cached.is_dir():
+                return False
+            workspace = self.workspace(job_id)
+            for path in self.outputs(job_id):
+                path.unlink()
+            for path in cached.iterdir():
+                _link_or_copy(path, workspace / path.name)
+            os.utime(cached)
+        return True
+
+    def store_cached(self, digest, job_id):
+        """Keep this job's outputs under their input hash, then trim the cache."""
+        cached = self.cache_dir / digest
+        with self.cache_lock:
+            try:
+                cached.mkdir(parents=True, exist_ok=True)
+                for path in self.outputs(job_id):
+                    _link_or_copy(path, cached / path.name)
+                self._evict()
+            except OSError as e:
+                logger.warning(f"Could not cache conversion {digest[:12]}: {e}")
+                shutil.rmtree(cached, ignore_errors=True)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in self.cache_dir.iterdir():
+            size = sum(path.stat().st_size for path in entry.iterdir())
+            entries.append((entry.stat().st_mtime, size, entry))
+            total += size
+        for _, size, entry in sorted(entries):
+            if total <= self.cache_max_bytes:
+                break
+            shutil.rmtree(entry)
+            total -= size
+
+    def run_pyrocksmith(self, source: Path):
+        with SUBPROCESS_SECONDS.time(tool="pyrocksmith"):
+            proc = subprocess.run(
+                [str(self.pyrocksmith), "--convert", str(source)],
+                cwd=source.parent,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        if proc.returncode != 0:
+            SUBPROCESS_FAILURES.inc(tool="pyrocksmith")
+            raise RuntimeError(
+                f"pyrocksmith failed ({proc.returncode}) on {source.name}: "
+                f"{proc.stderr.decode().strip()}"
+            )
+
+    def publish(self, job_id, names=None, digest=None) -> List[Path]:
+        """Move this job's psarcs to staging and remove its workspace.
+
+        names defaults to every _m/_p psarc in the workspace; a name that is
+        already in staging and not in the workspace was published before a
+        restart. Two songs can share a canonical Artist_Title name, so an
+        output whose name is taken by different content in staging is
+        published tagged with the download's digest (or its own) instead of
+        replacing it.
+        """
+        workspace = self.workspace(job_id)
+        if names is None:
+            names = [path.name for path in self.outputs(job_id)]
+        outputs = []
+        for name in names:
+            source = workspace / name
+            dest = self.staging / name
+            if not source.exists():
+                candidates = [dest]
+                if digest:
+                    candidates.insert(0, self.staging / tagged(name, digest[:8]))
+                outputs.extend([path for path in candidates if path.exists()][:1])
+                continue
+            if dest.exists():
+                content = hash_file(source)
+                entry = self.get_catalog().get("staging", name)
+                existing = entry.hash if entry and entry.hash else hash_file(dest)
+                if content == existing:
+                    logger.info(f"{name} is already in staging, dropping the copy")
+                    source.unlink()
+                    outputs.append(dest)
+                    continue
+                dest = self.staging / tagged(name, (digest or content)[:8])
+                logger.warning(
+                    f"Staging already has a different {name}, publishing {dest.name}"
+                )
+            moved = move(source, dest)
+            logger.info(
+                f"Moved {source} to {dest} in {moved.seconds:.1f}s",
+                extra={
+                    "path": source,
+                    "dest": dest,
+                    "bytes": moved.size,
+                    "seconds": round(moved.seconds, 4),
+                },
+            )
+            self.get_catalog().record_add("staging", dest, moved.hash)
+            outputs.append(dest)
+        shutil.rmtree(workspace, ignore_errors=True)
+        return outputs
+
+
+def _link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
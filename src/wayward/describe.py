@@ -0,0 +1,212 @@
+"""Long-lived LLaVA server that describes images without reloading the model.
+
+The llamafile is started once in ``--server`` mode on localhost and kept
+warm. Callers queue images with ``describe()``; a batching thread gathers
+whatever is queued (waiting ``LLAVA_BATCH_WAIT`` for stragglers) and sends up
+to ``LLAVA_PARALLEL`` requests at once, which the server decodes together in
+its parallel slots.
+"""
+
+import atexit
+import base64
+import json
+import logging
+import queue
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from wayward.config import (
+    LLAVA,
+    LLAVA_BATCH_WAIT,
+    LLAVA_HOST,
+    LLAVA_PARALLEL,
+    LLAVA_PORT,
+    LLAVA_REQUEST_TIMEOUT,
+    LLAVA_STARTUP_TIMEOUT,
+)
+from wayward.metrics import SUBPROCESS_FAILURES, SUBPROCESS_SECONDS
+from wayward.rename_picure_from_contents import LLAVA_TEMP, LLAVA_TOKENS
+
+logger = logging.getLogger(__name__)
+
+IMAGE_ID = 10
+PROMPT = f"### User: [img-{IMAGE_ID}]The image has...\n### Assistant:"
+
+
+class DescriptionService:
+    def __init__(
+        self,
+        llamafile=LLAVA,
+        host=LLAVA_HOST,
+        port=LLAVA_PORT,
+        parallel=LLAVA_PARALLEL,
+        batch_wait=LLAVA_BATCH_WAIT,
+    ):
+        self.llamafile = llamafile
+        self.url = f"http://{host}:{port}"
+        self.host = host
+        self.port = port
+        self.parallel = parallel
+        self.batch_wait = batch_wait
+        self.requests = queue.Queue()
+        self.pool = ThreadPoolExecutor(parallel, thread_name_prefix="wayward-llava")
+        self.proc = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        """Cache stamp for descriptions produced by this model and sampling."""
+        return f"{self.llamafile.name}:temp={LLAVA_TEMP}:n={LLAVA_TOKENS}"
+
+    def describe(self, path, timeout=LLAVA_REQUEST_TIMEOUT) -> str:
+        """Return the model's description of the image at path."""
+        self.ensure_started()
+        future = Future()
+        self.requests.put((str(path), future))
+        return future.result(timeout)
+
+    def ensure_started(self):
+        with self.lock:
+            if self.thread is None:
+                self._start_server()
+                self.thread = threading.Thread(
+                    target=self._batch_loop, name="wayward-llava-batch", daemon=True
+                )
+                self.thread.start()
+            elif self.proc is not None and self.proc.poll() is not None:
+                logger.error(
+                    f"LLaVA server exited ({self.proc.returncode}), restarting"
+                )
+                self._start_server()
+
+    def stop(self):
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+        self.pool.shutdown()
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.proc = None
+
+    def healthy(self) -> bool:
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=1) as resp:
+                return resp.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def _start_server(self):
+        if self.healthy():
+            logger.info(f"Using LLaVA server already listening at {self.url}")
+            return
+        if not self.llamafile.exists():
+            raise RuntimeError(
+                f"{self.llamafile} not found. Please download and specify the correct path."
+            )
+        cmd = [
+            "/bin/bash",
+            str(self.llamafile),
+            "--server",
+            "--nobrowser",
+            "--host",
+            self.host,
+            "--port",
+            str(self.port),
+            "-ngl",
+            "999",
+            "--parallel",
+            str(self.parallel),
+            "--log-disable",
+        ]
+        logger.info(f"Starting LLaVA server: {' '.join(cmd)}")
+        self.proc = subprocess.Popen(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + LLAVA_STARTUP_TIMEOUT
+        while not self.healthy():
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"LLaVA server exited with {self.proc.returncode}")
+            if time.monotonic() > deadline:
+                self.proc.kill()
+                raise RuntimeError("LLaVA server did not become healthy in time")
+            time.sleep(0.5)
+        logger.info(f"LLaVA server ready at {self.url}")
+
+    def _batch_loop(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.parallel:
+                try:
+                    item = self.requests.get(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.requests.put(None)
+                    break
+                batch.append(item)
+
+            logger.debug(f"Describing batch of {len(batch)} images")
+            futures = [self.pool.submit(self._complete, path) for path, _ in batch]
+            for (path, future), done in zip(batch, futures):
+                try:
+                    future.set_result(done.result())
+                except Exception as e:
+                    future.set_exception(e)
+
+    def _complete(self, path) -> str:
+        with open(path, "rb") as f:
+            image = base64.b64encode(f.read()).decode()
+        body = json.dumps(
+            {
+                "prompt": PROMPT,
+                "image_data": [{"data": image, "id": IMAGE_ID}],
+                "temperature": LLAVA_TEMP,
+                "n_predict": LLAVA_TOKENS,
+            }
+        ).encode()
+        req = urllib.request.Request(
+            f"{self.url}/completion",
+            data=body,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with SUBPROCESS_SECONDS.time(tool="llava"):
+                with urllib.request.urlopen(req, timeout=LLAVA_REQUEST_TIMEOUT) as resp:
+                    content = json.load(resp).get("content", "").strip()
+        except (urllib.error.URLError, OSError):
+            SUBPROCESS_FAILURES.inc(tool="llava")
+            raise
+        if not content:
+            SUBPROCESS_FAILURES.inc(tool="llava")
+            raise RuntimeError(f"LLaVA returned no description for {path}")
+        return content
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> DescriptionService:
+    """Return the process-wide description service, creating it on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = DescriptionService()
+            atexit.register(_service.stop)
+        return _service
@@ -0,0 +1,234 @@
+"""Bounded worker pools that run file jobs off the watchdog observer thread.
+
+Jobs are split into lanes by what their handlers cost: ``fast`` for renames
+and moves, ``convert`` for CPU-heavy conversions and ``inference`` for OCR
+and the LLaVA model. Every lane has its own queue and workers, so a burst of
+conversions never delays a screenshot.
+
+Each lane queues at most ``queue_size`` jobs, and ``submit`` waits for room.
+The stabilizer's single thread submits with ``wait=False`` instead: waiting
+there for one busy lane would hold up files bound for every lane, so a
+refused file stays pending in the stabilizer and is offered again later.
+
+Heavy lanes are deprioritized rather than throttled further: their workers
+renice themselves and can move to the idle I/O class. On Linux both are per
+thread and inherited by the processes a thread starts, so pyrocksmith and
+llamafile run at the lane's priority too.
+"""
+
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from typing import NamedTuple
+
+from wayward.config import DISPATCH_QUEUE_SIZE, DISPATCH_WORKERS, LANES
+
+logger = logging.getLogger(__name__)
+
+FAST = "fast"
+CONVERT = "convert"
+INFERENCE = "inference"
+# Cheapest first; a job whose handlers span lanes runs in the costliest.
+ORDER = (FAST, CONVERT, INFERENCE)
+
+_STOP = object()
+
+
+class Lane(NamedTuple):
+    workers: int
+    nice: int = 0
+    idle_io: bool = False
+
+
+def costliest(lanes) -> str:
+    """The lane to run a job in, given the lanes of its handlers."""
+    lanes = set(lanes)
+    for lane in reversed(ORDER):
+        if lane in lanes:
+            return lane
+    return FAST
+
+
+def lower_priority(name, lane: Lane):
+    """Apply lane's nice and I/O class to the calling thread."""
+    tid = threading.get_native_id()
+    if lane.nice:
+        try:
+            # Never raise priority above what the daemon was started with.
+            current = os.getpriority(os.PRIO_PROCESS, tid)
+            os.setpriority(os.PRIO_PROCESS, tid, max(current, lane.nice))
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Could not renice {name} worker: {e}")
+    if lane.idle_io:
+        ionice = shutil.which("ionice")
+        if ionice is None:
+            logger.debug(f"No ionice, {name} worker keeps its I/O priority")
+            return
+        proc = subprocess.run(
+            [ionice, "-c", "3", "-p", str(tid)], capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            logger.warning(f"Could not ionice {name} worker: {proc.stderr.strip()}")
+
+
+class Dispatcher:
+    """Run submitted jobs on a fixed set of worker threads per lane.
+
+    ``submit`` only enqueues, so the caller returns as soon as the lane has
+    room.
+    ``workers`` sizes the fast lane; ``lanes`` maps the others to a
+    ``Lane`` (or a tuple of its fields).
+    """
+
+    def __init__(
+        self, workers=DISPATCH_WORKERS, queue_size=DISPATCH_QUEUE_SIZE, lanes=None
+    ):
+        lanes = {
+            name: Lane(*spec)
+            for name, spec in (LANES if lanes is None else lanes).items()
+        }
+        lanes[FAST] = lanes.get(FAST, Lane(workers))._replace(workers=workers)
+        self.lanes = lanes
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in lanes}
+        self.threads = []
+        self.accepting = False
+        self.saturated = set()
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+
+    @property
+    def workers(self) -> int:
+        return sum(lane.workers for lane in self.lanes.values())
+
+    def start(self):
+        self.accepting = True
+        for name, lane in self.lanes.items():
+            for n in range(lane.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(name,),
+                    name=f"wayward-{name}-{n}",
+                    daemon=True,
+                )
+                thread.start()
+                self.threads.append((name, thread))
+        logger.info(
+            "Started dispatch workers: "
+            + ", ".join(f"{name} {lane.workers}" for name, lane in self.lanes.items())
+        )
+
+    def submit(self, fn, *args, lane=FAST, wait=True) -> bool:
+        """Queue ``fn(*args)`` in lane, waiting while that lane is full.
+
+        With ``wait=False`` a full lane refuses the job instead. False if
+        the job was refused or the dispatcher is shut down. A lane with no
+        workers configured runs in the fast lane.
+        """
+        if not self.accepting:
+            logger.warning(f"Dispatcher is shut down, dropping job {fn.__name__}")
+            return False
+        if lane not in self.queues:
+            lane = FAST
+        jobs = self.queues[lane]
+        try:
+            jobs.put_nowait((fn, args))
+            self.saturated.discard(lane)
+            return True
+        except queue.Full:
+            if lane not in self.saturated:
+                # Warn once per backlog, not once per refused submit.
+                self.saturated.add(lane)
+                logger.warning(
+                    f"Dispatch lane {lane} full ({jobs.maxsize}), holding new jobs"
+                )
+            if not wait:
+                return False
+        jobs.put((fn, args))
+        return True
+
+    def depth(self, lane=None) -> int:
+        if lane is not None:
+            return self.queues[lane].qsize()
+        return sum(jobs.qsize() for jobs in self.queues.values())
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "workers": lane.workers,
+                "nice": lane.nice,
+                "queued": self.depth(name),
+            }
+            for name, lane in self.lanes.items()
+        }
+
+    @property
+    def paused(self) -> bool:
+        return not self.unpaused.is_set()
+
+    def pause(self):
+        """Hold queued jobs; running ones finish and submit keeps queueing."""
+        self.unpaused.clear()
+        logger.info("Dispatch paused")
+
+    def resume(self):
+        self.unpaused.set()
+        logger.info("Dispatch resumed")
+
+    def drain(self, timeout=None) -> bool:
+        """Block until every queued job has finished; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for jobs in self.queues.values():
+            with jobs.all_tasks_done:
+                while jobs.unfinished_tasks:
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    jobs.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, drain=True):
+        """Stop accepting jobs, optionally finish queued ones, join workers."""
+        self.accepting = False
+        self.unpaused.set()
+        if not drain:
+            dropped = 0
+            for jobs in self.queues.values():
+                while True:
+                    try:
+                        jobs.get_nowait()
+                    except queue.Empty:
+                        break
+                    jobs.task_done()
+                    dropped += 1
+            if dropped:
+                logger.warning(f"Dropped {dropped} queued jobs on shutdown")
+
+        for name, _ in self.threads:
+            self.queues[name].put((_STOP, ()))
+        for _, thread in self.threads:
+            thread.join()
+        self.threads = []
+        logger.info("Dispatch workers stopped")
+
+    def _work(self, name):
+        lower_priority(name, self.lanes[name])
+        jobs = self.queues[name]
+        while True:
+            fn, args = jobs.get()
+            # Idle workers are already parked in get(), so hold the job here.
+            self.unpaused.wait()
+            try:
+                if fn is _STOP:
+                    return
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Job {fn.__name__} failed: {e}")
+                logger.exception(e)
+            finally:
+                jobs.task_done()
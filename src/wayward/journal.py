@@ -0,0 +1,227 @@
+"""Write-ahead journal of in-flight jobs, so a crash doesn't strand files.
+
+Every job is logged as it passes each stage: ``stabilized`` when it is
+queued, then for conversions ``buildspace`` (moved into its workspace),
+``converted`` and ``published``, and finally ``done``, ``failed`` or
+``lost``. Rows are only ever appended. A job's current state is its latest
+row, so resuming after a crash means replaying the jobs whose latest row
+isn't terminal from the stage they last reached.
+
+Appends are durable before they return (``synchronous=FULL``), but threads
+logging at the same time share one commit: whoever finds no commit in
+progress writes everything queued so far, and the rest wait for it. Job ids
+are derived from the file's path, size and mtime, so a resumed job finds
+the workspace it was using before the restart.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from wayward.config import JOURNAL_DB, JOURNAL_KEEP
+
+logger = logging.getLogger(__name__)
+
+STABILIZED = "stabilized"
+BUILDSPACE = "buildspace"
+CONVERTED = "converted"
+PUBLISHED = "published"
+STAGES = (STABILIZED, BUILDSPACE, CONVERTED, PUBLISHED)
+
+DONE = "done"
+FAILED = "failed"
+LOST = "lost"
+TERMINAL = (DONE, FAILED, LOST)
+
+
+class Job(NamedTuple):
+    job_id: str
+    path: str
+    stage: str
+    detail: dict
+    started: float
+
+
+def job_id_for(path, st=None) -> str:
+    """Stable id for this version of the file at path."""
+    st = st or os.stat(path)
+    key = f"{Path(path).resolve()}:{st.st_size}:{st.st_mtime_ns}"
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(st.st_mtime))
+    return f"{stamp}-{hashlib.sha1(key.encode()).hexdigest()[:8]}"
+
+
+def reached(job: Optional[Job], stage) -> bool:
+    """True if job has already completed stage."""
+    if job is None or job.stage not in STAGES:
+        return False
+    return STAGES.index(job.stage) >= STAGES.index(stage)
+
+
+class Journal:
+    def __init__(self, path=JOURNAL_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.cond = threading.Condition()
+        self.pending = []
+        self.appended = 0
+        self.committed = 0
+        self.committing = False
+        self.db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=FULL;
+            CREATE TABLE IF NOT EXISTS stages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                path TEXT NOT NULL,
+                detail TEXT NOT NULL,
+                at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS stages_job ON stages (job_id);
+            """
+        )
+        self.jobs = {job.job_id: job for job in self._load()}
+
+    def _load(self) -> List[Job]:
+        latest = self.db.execute(
+            "SELECT job_id, stage, MAX(seq) FROM stages GROUP BY job_id"
+        ).fetchall()
+        open_ids = [job_id for job_id, stage, _ in latest if stage not in TERMINAL]
+        jobs = []
+        for job_id in open_ids:
+            job = None
+            for stage, path, detail, at in self.db.execute(
+                "SELECT stage, path, detail, at FROM stages "
+                "WHERE job_id = ? ORDER BY seq",
+                (job_id,),
+            ):
+                if job is None or stage == STABILIZED:
+                    job = Job(job_id, path, stage, {}, at)
+                job = job._replace(
+                    path=path, stage=stage, detail={**job.detail, **json.loads(detail)}
+                )
+            jobs.append(job)
+        return sorted(jobs, key=lambda job: job.started)
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the connection; called with self.cond held."""
+        while self.committing:
+            self.cond.wait()
+        self.committing = True
+        self.cond.release()
+        try:
+            yield self.db
+        finally:
+            self.cond.acquire()
+            self.committing = False
+            self.cond.notify_all()
+
+    def _append(self, row):
+        """Log row and return once it (and anything queued with it) is on disk."""
+        with self.cond:
+            self.pending.append(row)
+            self.appended += 1
+            ticket = self.appended
+            while self.committed < ticket:
+                if self.committing:
+                    self.cond.wait()
+                    continue
+                batch, self.pending = self.pending, []
+                upto = self.appended
+                with self._exclusive() as db:
+                    try:
+                        with db:
+                            db.executemany(
+                                "INSERT INTO stages (job_id, stage, path, detail, at) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                batch,
+                            )
+                    except sqlite3.Error as e:
+                        # Keep handling files; only crash recovery is lost.
+                        logger.error(f"Journal write of {len(batch)} rows failed: {e}")
+                self.committed = upto
+
+    def begin(self, path) -> Job:
+        """Start (or restart) the job for the file now at path."""
+        path = Path(path)
+        st = path.stat()
+        job_id = job_id_for(path, st)
+        with self.cond:
+            self.jobs.pop(job_id, None)
+        return self.record(job_id, STABILIZED, path, size=st.st_size, source=str(path))
+
+    def record(self, job_id, stage, path=None, **detail) -> Job:
+        """Log that job_id has completed stage; path is where its file now is."""
+        now = time.time()
+        with self.cond:
+            job = self.jobs.get(job_id) or Job(job_id, str(path or ""), stage, {}, now)
+            job = job._replace(
+                path=str(path or job.path),
+                stage=stage,
+                detail={**job.detail, **detail},
+            )
+            if stage in TERMINAL:
+                self.jobs.pop(job_id, None)
+            else:
+                self.jobs[job_id] = job
+        self._append((job_id, stage, job.path, json.dumps(detail), now))
+        return job
+
+    def finish(self, job_id, stage=DONE):
+        self.record(job_id, stage)
+
+    def find(self, path) -> Optional[Job]:
+        """The open job whose file is at path."""
+        path = str(path)
+        with self.cond:
+            for job in self.jobs.values():
+                if job.path == path:
+                    return job
+        return None
+
+    def unfinished(self) -> List[Job]:
+        with self.cond:
+            return sorted(self.jobs.values(), key=lambda job: job.started)
+
+    def prune(self, keep=JOURNAL_KEEP) -> int:
+        """Drop the rows of jobs that finished more than keep seconds ago."""
+        cutoff = time.time() - keep
+        with self.cond, self._exclusive() as db, db:
+            removed = db.execute(
+                f"""
+                DELETE FROM stages WHERE job_id IN (
+                    SELECT job_id FROM (
+                        SELECT job_id, stage, at, MAX(seq) FROM stages
+                        GROUP BY job_id
+                    )
+                    WHERE stage IN ({", ".join("?" * len(TERMINAL))}) AND at < ?
+                )
+                """,
+                (*TERMINAL, cutoff),
+            ).rowcount
+        if removed:
+            logger.info(f"Pruned {removed} journal rows")
+        return removed
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> Journal:
+    """Return the process-wide journal."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal()
+        return _journal
@@ -0,0 +1,90 @@
+"""Single-instance lock for the daemon.
+
+An exclusive ``flock`` on ``LOCK_FILE`` is held for the life of the process.
+The kernel drops it when the process dies, however it dies, so a leftover
+file holding a dead pid is simply stale and gets taken over. The file's
+contents are only informational (the owner's pid, for messages and
+``wayward-ctl``).
+"""
+
+import fcntl
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+from wayward.config import LOCK_FILE
+
+logger = logging.getLogger(__name__)
+
+
+class AlreadyRunning(RuntimeError):
+    def __init__(self, pid):
+        self.pid = pid
+        super().__init__(f"daemon already running (pid {pid or 'unknown'})")
+
+
+def pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PidLock:
+    def __init__(self, path=LOCK_FILE):
+        self.path = Path(path)
+        self.file = None
+
+    def read_pid(self) -> Optional[int]:
+        try:
+            text = self.path.read_text().strip()
+        except FileNotFoundError:
+            return None
+        return int(text) if text.isdigit() else None
+
+    def acquire(self):
+        """Take the lock or raise AlreadyRunning with the holder's pid."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            pid = self.read_pid()
+            if pid is not None and not pid_alive(pid):
+                # The lock outlived its pid: a child that inherited the
+                # descriptor is still running.
+                logger.warning(f"Lock {self.path} held on behalf of dead pid {pid}")
+            raise AlreadyRunning(pid)
+        self.file = f
+        previous = self.read_pid()
+        if previous is not None and previous != os.getpid():
+            logger.info(f"Taking over stale lock from pid {previous}")
+        self.write_pid()
+
+    def write_pid(self):
+        """Record our pid; call again after daemonizing changes it."""
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(f"{os.getpid()}\n")
+        self.file.flush()
+
+    def release(self):
+        if self.file is None:
+            return
+        self.file.seek(0)
+        self.file.truncate()
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
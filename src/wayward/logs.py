@@ -0,0 +1,169 @@
+"""Logging off the hot path: one queue in front of every real log handler.
+
+``setup`` gives the ``wayward`` logger a single ``QueueHandler``, so a
+``logger.info`` on the observer or a worker thread only formats the message
+and appends it to an in-memory queue. A ``QueueListener`` thread makes the
+syslog and file writes. The file rotates by size (or by time, with
+``LOG_ROTATE_WHEN``), and the listener gzips each rotated file.
+
+With ``--log-format json`` the file and stderr get one JSON object per
+line. Each object carries the message, any of ``FIELDS`` the call passed in
+``extra`` (handler, path, bytes, seconds, ...), and the id of the job the
+thread was running, plus ``exc`` with the traceback of a failed job.
+Per-file latencies can then be read straight from the log.
+"""
+
+import atexit
+import contextvars
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+from contextlib import contextmanager
+
+from wayward.config import (
+    LOG_BACKUPS,
+    LOG_FILE,
+    LOG_FORMAT,
+    LOG_MAX_BYTES,
+    LOG_ROTATE_WHEN,
+)
+
+TEXT = "text"
+JSON = "json"
+FORMATS = (TEXT, JSON)
+
+# Record attributes copied into JSON lines when a log call sets them.
+FIELDS = ("job", "handler", "path", "dest", "bytes", "seconds", "latency", "status")
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+SYSLOG_SOCKET = "/dev/log"
+
+_job = contextvars.ContextVar("job", default=None)
+
+
+@contextmanager
+def job(job_id):
+    """Tag everything the calling thread logs inside the block with job_id."""
+    token = _job.set(job_id)
+    try:
+        yield
+    finally:
+        _job.reset(token)
+
+
+class JobFilter(logging.Filter):
+    """Stamp each record with the job its thread is running.
+
+    Runs in the emitting thread, before the record crosses the queue.
+    """
+
+    def filter(self, record) -> bool:
+        if getattr(record, "job", None) is None:
+            record.job = _job.get()
+        return True
+
+
+class TracebackQueueHandler(logging.handlers.QueueHandler):
+    """Queue records with the traceback beside the message, not folded into it.
+
+    The stock ``prepare`` formats the traceback into ``msg`` and drops
+    ``exc_info``, which leaves the JSON formatter nothing to put in ``exc``.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # The traceback holds every frame alive; the text is all we need.
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value if isinstance(value, (int, float)) else str(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry)
+
+
+def gzip_namer(name) -> str:
+    return f"{name}.gz"
+
+
+def gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def file_handler(
+    path=LOG_FILE, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS, when=LOG_ROTATE_WHEN
+) -> logging.Handler:
+    """A file handler that rotates by size, or by time if when is set, and gzips."""
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backups
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups
+        )
+    handler.namer = gzip_namer
+    handler.rotator = gzip_rotator
+    return handler
+
+
+def setup(
+    logger, foreground=False, fmt=LOG_FORMAT, path=LOG_FILE
+) -> logging.handlers.QueueListener:
+    """Route logger through a queue to path, syslog and (foreground) stderr."""
+    if fmt not in FORMATS:
+        raise ValueError(f"log format must be one of {FORMATS}, not {fmt!r}")
+    formatter = JsonFormatter() if fmt == JSON else logging.Formatter(TEXT_FORMAT)
+
+    handlers = [file_handler(path)]
+    if foreground:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    # SysLogHandler only notices a missing socket on every emit.
+    syslog = os.path.exists(SYSLOG_SOCKET)
+    if syslog:
+        handler = logging.handlers.SysLogHandler(address=SYSLOG_SOCKET)
+        handler.setFormatter(logging.Formatter(f"{logger.name}: %(message)s"))
+        handlers.append(handler)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        records, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
+    enqueue = TracebackQueueHandler(records)
+    enqueue.addFilter(JobFilter())
+    logger.setLevel(logging.INFO)
+    logger.addHandler(enqueue)
+    if not syslog:
+        # Said through the log file: a daemon's stderr is /dev/null.
+        logger.warning(f"No {SYSLOG_SOCKET}, not logging to syslog")
+    return listener
@@ -2,71 +2,157 @@
 import argparse
 from datetime import datetime
 import logging
-from os import getpid
-from typing import List
-import psutil
+from typing import List, Optional
 import os
 import re
-import shutil
-import subprocess
+import sqlite3
 import sys
+import threading
 import time
 from pathlib import Path
 import setproctitle
 from watchdog.events import FileSystemEventHandler
-from watchdog.observers import Observer
-import logging.handlers
 import daemon
 
+from wayward import logs, metrics, mover, phash
+from wayward import rename_picure_from_contents as renamer
+from wayward.cache import CachedDescriber, cached_ocr, get_cache
+from wayward.coalesce import NEW, PENDING, RENAMED, Coalescer
+from wayward.config import (
+    DISPATCH_QUEUE_SIZE,
+    DISPATCH_RETRY,
+    DISPATCH_WORKERS,
+    IMAGE_SUFFIXES,
+    INDEX_SCREENSHOTS,
+    LOG_FORMAT,
+    METRICS_PORT,
+    SCREENSHOTS,
+)
+from wayward.control import ControlError, ControlServer
+from wayward.control import request as control_request
+from wayward.convert import ConversionScheduler
+from wayward.describe import get_service
+from wayward.dispatch import CONVERT, FAST, INFERENCE, Dispatcher, costliest
+from wayward.journal import FAILED, LOST, Journal, get_journal
+from wayward.lock import AlreadyRunning, PidLock
+from wayward.metrics import COALESCED, EVENTS, HANDLER_FAILURES, HANDLER_SECONDS
+from wayward.ocr import get_pool as get_ocr_pool
+from wayward.psarc import canonical_name, read_metadata, summary
+from wayward.routing import ALL, FIRST, Router, Rule
+from wayward.search import SearchError, get_index, ocr_sidecar
+from wayward.stabilize import Stabilizer
+from wayward.watch import WatchRoot, WatchSet
+
 
 NAME = "wayward"
 logger = logging.getLogger(NAME)
 
+# Names browsers download to, renamed to the final name once complete.
+DOWNLOAD_SUFFIXES = frozenset({".part", ".crdownload"})
+
+
+def is_partial(file_path) -> bool:
+    """A browser download still being written, never handed to handlers."""
+    return file_path.suffix in DOWNLOAD_SUFFIXES
+
 
 class Watcher:
-    def __init__(self, dirpath, handler):
-        self.observer = Observer()
-        self.dirpath = dirpath
+    def __init__(self, roots, handler):
+        if isinstance(roots, (str, os.PathLike)):
+            # A single directory, routed by the handler's own router.
+            roots = [WatchRoot(roots)]
+        self.roots = list(roots)
         self.event_handler = handler
+        self.event_handler.roots = self.roots
+        self.watches = WatchSet(self.roots, handler)
+        self.stopping = threading.Event()
+
+    def reconcile(self):
+        for directory in self.watches.directories():
+            self.event_handler.reconcile(directory)
 
     def run(self):
-        self.observer.schedule(self.event_handler, self.dirpath, recursive=False)
-        self.observer.start()
+        self.event_handler.start()
+        self.watches.start()
+        # Finish what was in flight last time, then pick up anything that
+        # arrived while we weren't watching.
+        self.event_handler.resume()
+        self.reconcile()
         try:
-            while True:
-                time.sleep(5)
-                if not self.observer.is_alive():
+            while not self.stopping.wait(5):
+                if not self.watches.is_alive():
                     logger.error("Observer thread died, restarting...")
-                    self.observer = Observer()
-                    self.observer.schedule(
-                        self.event_handler, self.dirpath, recursive=False
-                    )
-                    self.observer.start()
+                    self.watches.restart()
+                    self.reconcile()
         except KeyboardInterrupt:
             logger.info("Received interrupt, shutting down...")
         except Exception as e:
             logger.error(f"Error: {e}")
         finally:
-            self.observer.stop()
-            self.observer.join()
+            self.watches.stop()
+            self.event_handler.stop()
+
+    def stop(self):
+        """Ask run() to return from another thread."""
+        self.stopping.set()
 
 
 class FileTypeHandler:
-    def __init__(self, file_filter, file_handler):
+    # Dispatch lane to run in; handlers that convert or describe override it.
+    lane = FAST
+    # Set by Handler; without one, follow-up jobs run inline.
+    dispatcher = None
+
+    def __init__(self, file_filter, file_handler, lane=FAST):
         self.file_filter = file_filter
         self.file_handler = file_handler
+        self.lane = lane
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__}: {self.file_filter.__name__}"
 
     def handle(self, path):
         if self.file_filter(path):
-            logger.info(f"Handling file... {path} with {self}")
+            return self.process(path)
+
+    def process(self, path):
+        """Run the handler on a path that is already known to match."""
+        name = self.__class__.__name__
+        fields = {"handler": name, "path": path}
+        logger.info(f"Handling file... {path} with {self}", extra=fields)
+        started = time.monotonic()
+        with HANDLER_SECONDS.time(handler=name):
             try:
-                return self.file_handler(path)
-            except RuntimeError as e:
-                logger.error(f"Failed to handle file ({path}) with {self}.")
-                logger.exception(e)
+                result = self.file_handler(path)
+            except Exception:
+                # Handler.handle_file logs the traceback and fails the job.
+                HANDLER_FAILURES.inc(handler=name)
+                logger.error(
+                    f"Failed to handle file ({path}) with {self}.",
+                    extra={**fields, "status": "failed"},
+                )
+                raise
+        seconds = time.monotonic() - started
+        logger.info(
+            f"Handled {path.name} with {name} in {seconds:.3f}s",
+            extra={**fields, "seconds": round(seconds, 4)},
+        )
+        return result
+
+    def defer(self, fn, *args, lane=INFERENCE):
+        """Run fn(*args) as a job of its own in lane, once this one is filed.
+
+        For work the file doesn't wait on, like OCR and indexing, so a
+        cheap move isn't held in its lane behind a model.
+        """
+        if self.dispatcher is not None and self.dispatcher.accepting:
+            self.dispatcher.submit(fn, *args, lane=lane)
+        else:
+            fn(*args)
+
+    def resumable(self, job) -> bool:
+        """Whether a journaled job interrupted by a restart can be run again."""
+        return Path(job.path).exists()
 
     def sanitize_file(self, current):
         dirname = current.parent.absolute()
@@ -80,111 +166,81 @@ class FileTypeHandler:
             return to_path
 
     def is_image(self, path) -> bool:
-        return path.suffix.lower() in [
-            ".png",
-            ".jpg",
-            ".jpeg",
-            ".tiff",
-            ".bmp",
-            ".gif",
-        ]
+        return path.suffix.lower() in IMAGE_SUFFIXES
 
     def is_screen_shot(self, path) -> bool:
-        return self.is_image(path) and "shot_" == path.name.lower()[0:5]
+        return self.is_image(path) and path.name.lower().startswith("shot_")
 
     def rename_picture_from_contents(self, path: Path) -> Path:
-        logger.info("Renaming picture from contents...")
-        RENAMER = "/home/ahonnecke/bin/rename_picure_from_contents.py"
-        cmd = [
-            RENAMER,
-            str(path),
-        ]
+        """Rename using the resident LLaVA server instead of a fresh llamafile.
 
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,  # Capture stdout
-            stderr=subprocess.PIPE,  # Capture stderr
-        )
-        stdout, stderr = proc.communicate()
+        Slow; call it from an ``INFERENCE`` handler or through ``defer``.
+        """
+        logger.info("Renaming picture from contents...")
+        describer = CachedDescriber(get_service(), get_cache())
+        newpath = renamer.rename(str(path), service=describer)
 
-        if not stdout:
-            raise RuntimeError(stderr.decode())
+        if not newpath:
+            raise RuntimeError(f"Could not rename {path} from its contents")
 
-        return Path(stdout.decode().strip())
+        # Same content, so this is a cache hit.
+        self.index_picture(newpath, description=describer.describe(newpath))
+        return Path(newpath)
 
-    def ocr_picture(self, path: Path):
-        OCR_BIN = "/home/ahonnecke/bin/ocr_image.py"
+    def ocr_picture(self, path: Path) -> str:
         logger.info(f"OCRing image:{path}")
-        cmd = [OCR_BIN, str(path)]
+        return cached_ocr(get_ocr_pool(), get_cache(), path)
 
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,  # Capture stdout
-            stderr=subprocess.PIPE,  # Capture stderr
-        )
-        stdout, stderr = proc.communicate()
-
-        if not stdout:
-            raise RuntimeError(stderr.decode())
-
-        return stdout.decode().strip()
+    def index_picture(self, path, ocr=None, description=None):
+        """Add text for path to the search index; failures are only logged."""
+        try:
+            get_index().update(path, ocr=ocr, description=description)
+        except (SearchError, sqlite3.Error) as e:
+            logger.warning(f"Could not index {path}: {e}")
 
 
 class PsarcHandler(FileTypeHandler):
-    def __init__(self):
-        self.BUILDSPACE = Path("/home/ahonnecke/cdlc_buildspace")
-        self.PYROCKSMITH = Path("/home/ahonnecke/.pyenv/shims/pyrocksmith")
+    lane = CONVERT
+
+    def __init__(
+        self,
+        scheduler: Optional[ConversionScheduler] = None,
+        journal: Optional[Journal] = None,
+    ):
+        self.scheduler = scheduler or ConversionScheduler(
+            sanitize=self.canonicalize, journal=journal or get_journal()
+        )
 
     def file_filter(self, path) -> bool:
         return path.suffix == ".psarc"
 
-    def sanitize_psarcs_in_dir(self, dirpath, target_file):
-        """Sanitize all psarc filenames in dir, return new path of target_file."""
-        logger.info(f"Sanitizing filenames in {dirpath}")
-        target_basename = os.path.basename(target_file)
-        result_path = target_file
-
-        for file in dirpath.glob("*.psarc*"):
-            new_path = self.sanitize_file(file)
-            if new_path and file.name == target_basename:
-                result_path = str(new_path)
-
-        return result_path
-
-    def move_cdlc_to_staging(self):
-        from wayward.config import STAGING as STAGING_DEST
-
-        logger.info("Moving CDLC to NAS staging")
-        for filename in os.listdir(self.BUILDSPACE):
-            filepath = self.BUILDSPACE / filename
-
-            if ".psarc" in filename:
-                dest = STAGING_DEST / filename
-                shutil.move(str(filepath), str(dest))
-                logger.info(f"Moved {filepath} to {dest}")
-            else:
-                os.remove(filepath)
-                logger.info(f"Removed non-psarc {filepath}")
+    def resumable(self, job) -> bool:
+        # The download may already be in (or through) its workspace.
+        return super().resumable(job) or self.scheduler.workspace(job.job_id).is_dir()
+
+    def canonicalize(self, path):
+        """Rename to Artist_Title from the archive's manifest, else sanitize."""
+        info = read_metadata(path)
+        if info is None:
+            return self.sanitize_file(path)
+        logger.info(f"{path.name}: {summary(info)}")
+        new = path.with_name(canonical_name(info, path.name))
+        if new != path:
+            logger.info(f"Renaming {path} => {new}")
+            os.rename(path, new)
+            return new
 
     def file_handler(self, path):
-        file_path = Path(path)
-        filename = os.path.basename(file_path)
-        fullpath = f"{self.BUILDSPACE}/{filename}"
-
-        shutil.move(path, fullpath)
-        fullpath = self.sanitize_psarcs_in_dir(self.BUILDSPACE, fullpath)
-
-        subprocess.run(
-            [self.PYROCKSMITH, "--convert", fullpath],
-            stdout=subprocess.PIPE,
-        )
-        logger.info(f"Processed {fullpath} with pyrocksmith.")
-        self.move_cdlc_to_staging()
+        result = self.scheduler.convert(path)
+        logger.info(f"Processed {result.source.name}: {result.status}.")
+        return result
 
 
 class ScreenshotHandler(FileTypeHandler):
-    def __init__(self):
-        self.DEST = Path("/home/ahonnecke/screenshots")
+    def __init__(self, index=INDEX_SCREENSHOTS, dedupe=True):
+        self.DEST = SCREENSHOTS
+        self.index = index
+        self.dedupe = dedupe
 
     def file_filter(self, path) -> bool:
         return self.is_screen_shot(path)
@@ -195,12 +251,33 @@ class ScreenshotHandler(FileTypeHandler):
         Path(dirname).mkdir(parents=True, exist_ok=True)
 
         new_path = Path(os.path.join(dirname, path.name))
-        shutil.move(path, new_path)
+        if self.dedupe:
+            filed = phash.ingest(path, new_path)
+            if filed.skipped:
+                return
+            new_path = filed.path
+        else:
+            new_path = mover.move(path, new_path).dest
+
+        if self.index:
+            self.defer(self.index_text, new_path)
+
+    def index_text(self, path):
+        """OCR a filed screenshot into the search index (an inference job)."""
+        try:
+            text = self.ocr_picture(path)
+            # Next to the image, so wayward-search --rebuild finds it again.
+            ocr_sidecar(path).write_text(text)
+            self.index_picture(path, ocr=text)
+        except (RuntimeError, OSError) as e:
+            # Already filed; it just won't be searchable by its text.
+            logger.warning(f"Not indexing {path.name}: {e}")
 
 
 class ImageHandler(FileTypeHandler):
-    def __init__(self):
+    def __init__(self, dedupe=True):
         self.DEST = Path("/home/ahonnecke/Downloads/images")
+        self.dedupe = dedupe
 
     def file_filter(self, path) -> bool:
         return self.is_image(path) and not self.is_screen_shot(path)
@@ -211,7 +288,10 @@ class ImageHandler(FileTypeHandler):
         Path(dirname).mkdir(parents=True, exist_ok=True)
 
         new_path = Path(os.path.join(dirname, path.name))
-        shutil.move(path, new_path)
+        if self.dedupe:
+            phash.ingest(path, new_path)
+        else:
+            mover.move(path, new_path)
 
 
 class QmkHandler(FileTypeHandler):
@@ -223,109 +303,412 @@ class QmkHandler(FileTypeHandler):
         return path.suffix == ".bin"
 
     def file_handler(self, path):
-        return shutil.move(path, os.path.join(self.DEST, path.name))
+        return mover.move(path, os.path.join(self.DEST, path.name))
 
 
 class Handler(FileSystemEventHandler):
-    def __init__(self, file_handlers: List[FileTypeHandler]):
-        self.file_handlers = file_handlers
+    def __init__(
+        self,
+        file_handlers: Optional[List[FileTypeHandler]] = None,
+        dispatcher: Optional[Dispatcher] = None,
+        stabilizer: Optional[Stabilizer] = None,
+        router: Optional[Router] = None,
+        journal: Optional[Journal] = None,
+    ):
+        if router is None:
+            # Plain handler list: ask every file_filter, as before routing tables.
+            router = Router(
+                [Rule(h, predicate=h.file_filter) for h in file_handlers or []],
+                mode=ALL,
+            )
+        self.router = router
+        self.roots = []
+        self.dispatcher = dispatcher if dispatcher is not None else Dispatcher()
+        self.stabilizer = stabilizer if stabilizer is not None else Stabilizer()
+        self.coalescer = Coalescer()
+        # Stable files waiting in the stabilizer for room in their lane.
+        self.held = set()
+        self.journal = journal if journal is not None else get_journal()
+        metrics.QUEUE_DEPTH.set_function(self.dispatcher.depth)
+        metrics.PENDING_FILES.set_function(lambda: len(self.stabilizer))
+
+    @property
+    def handlers(self):
+        handlers = list(self.router.handlers)
+        for root in self.roots:
+            if root.router is not None:
+                handlers += [h for h in root.router.handlers if h not in handlers]
+        return handlers
+
+    def router_for(self, path) -> Router:
+        """The router of the innermost root that watches path."""
+        roots = [root for root in self.roots if root.contains(path)]
+        if not roots:
+            return self.router
+        root = max(roots, key=lambda root: len(root.path.parts))
+        return root.router or self.router
+
+    def lane_for(self, path, source=None) -> str:
+        """The dispatch lane of the costliest handler path is routed to."""
+        router = self.router_for(source or path)
+        return costliest(getattr(h, "lane", FAST) for h in router.route(Path(path)))
+
+    def reload(self, roots):
+        """Swap in freshly built routers, matching roots by path."""
+        routers = {root.path: root.router for root in roots}
+        for root in self.roots:
+            root.router = routers.get(root.path, root.router)
+        if roots:
+            self.router = roots[0].router
+        self.adopt()
+
+    def adopt(self):
+        """Let every handler queue follow-up jobs on this dispatcher."""
+        for handler in self.handlers:
+            handler.dispatcher = self.dispatcher
+
+    def start(self):
+        self.adopt()
+        self.dispatcher.start()
+        self.stabilizer.start()
+
+    def stop(self, drain=True):
+        """Stop stabilizing, finish (or drop) queued jobs and stop the workers."""
+        self.stabilizer.stop()
+        self.dispatcher.shutdown(drain=drain)
+        logger.info(f"Event coalescing: {self.coalescer.stats()}")
+
+    def watches(self, path) -> bool:
+        """Whether path is in the watched part of a root (always, without roots)."""
+        return not self.roots or any(root.contains(path) for root in self.roots)
 
     def on_any_event(self, event):
         if event.is_directory:
             return None
 
-        elif event.event_type == "created" or event.event_type == "modified":
+        # Recursive watches also report excluded and too-deep directories.
+        moved = event.event_type == "moved"
+        if not self.watches(event.dest_path if moved else event.src_path):
+            if moved and self.watches(event.src_path):
+                # Moved out of sight: as good as deleted.
+                self.forget(Path(event.src_path).resolve())
+            return None
+
+        EVENTS.inc(type=event.event_type)
+        if event.event_type == "created" or event.event_type == "modified":
             # Take any action here when a file is first created.
-            logger.info(f"Received created or modified - {event.src_path}.")
-            return self.handle_created(event)
+            logger.debug(f"Received {event.event_type} - {event.src_path}.")
+            return self.handle_created(event.src_path)
 
-    def wait_for_file(self, file_path):
-        """Wait for file size to stabilize, return final size."""
-        historical_size = -1
-        while True:
-            try:
-                current_size = os.path.getsize(str(file_path))
-            except FileNotFoundError:
-                return 0
-            if current_size == historical_size:
-                return historical_size
-            historical_size = current_size
-            time.sleep(1)
+        elif event.event_type == "moved":
+            return self.handle_moved(event.src_path, event.dest_path)
 
-    def handle_created(self, event):
-        try:
-            file_path = Path(event.src_path).resolve()
-            if not file_path.is_file():
-                return
+        elif event.event_type == "closed":
+            # IN_CLOSE_WRITE: the writer is done, so stabilization can be quick.
+            self.stabilizer.closed(Path(event.src_path).resolve())
 
-            if file_path.suffix == ".part" or file_path.name.endswith(".part"):
-                return
+        elif event.event_type == "deleted":
+            self.forget(Path(event.src_path).resolve())
 
-            historical_size = self.wait_for_file(file_path)
-            logger.info(f"File {file_path} has stabilized at {historical_size}")
+    def forget(self, file_path):
+        """Stop tracking a file that was deleted or moved out of sight."""
+        self.stabilizer.forget(file_path)
+        self.coalescer.discard(file_path)
+        self.held.discard(file_path)
+
+    def wait_for_file(self, file_path):
+        """Block until the file stabilizes, return final size."""
+        return self.stabilizer.wait(file_path)
+
+    def is_partial(self, file_path) -> bool:
+        return is_partial(file_path)
 
-            if historical_size < 1:
+    def handle_created(self, src_path):
+        """Start or extend tracking of a file. Runs on the observer thread."""
+        try:
+            file_path = Path(src_path).resolve()
+            if self.is_partial(file_path):
                 return
 
-            for handler in self.file_handlers:
-                handler.handle(file_path)
+            status, previous = self.coalescer.offer(file_path)
+            COALESCED.inc(outcome=status)
+            if status == PENDING:
+                self.stabilizer.touch(file_path)
+            elif status == RENAMED:
+                self.stabilizer.forget(previous)
+                self.stabilizer.track(file_path, self.on_stable)
+            elif status == NEW:
+                if not file_path.is_file():
+                    self.coalescer.discard(file_path)
+                    return
+                logger.info(f"Received {file_path}.")
+                self.stabilizer.track(file_path, self.on_stable)
         except Exception as e:
-            logger.error(f"Error handling {event.src_path}: {e}")
+            logger.error(f"Error handling {src_path}: {e}")
             logger.exception(e)
 
-
-def ensure_process_is_not_running(process_name: str) -> None:
-    mypid = getpid()
-    for process in psutil.process_iter():
-        if process.pid != mypid:
+    def reconcile(self, dirpath) -> int:
+        """Feed every file already in dirpath through the normal event path.
+
+        Files already pending or being handled are folded away by the
+        coalescer, so this is safe to run at any time.
+        """
+        count = 0
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    self.handle_created(entry.path)
+                    count += 1
+        if count:
+            logger.info(f"Catch-up scan of {dirpath} queued {count} files")
+        return count
+
+    def enqueue(self, path) -> bool:
+        """Queue an existing, complete file for the handlers now.
+
+        Skips stabilization; False if the file is missing or already tracked.
+        """
+        file_path = Path(path).resolve()
+        if not file_path.is_file() or self.is_partial(file_path):
+            return False
+        status, _ = self.coalescer.offer(file_path)
+        if status != NEW:
+            return False
+        if not self.coalescer.activate(file_path):
+            return False
+        return self.submit(file_path)
+
+    def submit(self, file_path) -> bool:
+        """Journal an active file as stabilized and queue it for the handlers.
+
+        Never waits: a file whose lane is full goes back to the stabilizer
+        as pending and is offered again after ``DISPATCH_RETRY``.
+        """
+        if file_path not in self.held:
             try:
-                cmdline = process.cmdline()
-            except psutil.NoSuchProcess:
+                self.journal.begin(file_path)
+            except FileNotFoundError:
+                self.coalescer.discard(file_path)
+                return False
+        lane = self.lane_for(file_path)
+        if self.dispatcher.submit(self.handle_file, file_path, lane=lane, wait=False):
+            self.held.discard(file_path)
+            return True
+        if not self.dispatcher.accepting:
+            self.held.discard(file_path)
+            return False
+        self.held.add(file_path)
+        self.coalescer.deactivate(file_path)
+        self.stabilizer.track(file_path, self.on_stable, delay=DISPATCH_RETRY)
+        return True
+
+    def resume(self) -> int:
+        """Requeue the jobs the journal says were in flight when we stopped."""
+        count = 0
+        for job in self.journal.unfinished():
+            path = Path(job.path)
+            router = self.router_for(job.detail.get("source", path))
+            if not any(h.resumable(job) for h in router.route(path)):
+                logger.warning(f"Dropping job {job.job_id}: {path} is gone")
+                self.journal.finish(job.job_id, LOST)
+                continue
+            status, _ = self.coalescer.offer(path)
+            if status != NEW or not self.coalescer.activate(path):
                 continue
+            logger.info(f"Resuming {path.name} after {job.stage} [{job.job_id}]")
+            self.dispatcher.submit(
+                self.handle_file,
+                path,
+                lane=self.lane_for(path, job.detail.get("source")),
+            )
+            count += 1
+        self.journal.prune()
+        return count
+
+    def handle_moved(self, src_path, dest_path):
+        """Keep one job across a rename, or pick up a finished download."""
+        src = Path(src_path).resolve()
+        dest = Path(dest_path).resolve()
+        # A browser only renames a download once it is written, and a file
+        # already closed by its writer doesn't change by being renamed.
+        finished = src.suffix in DOWNLOAD_SUFFIXES or self.stabilizer.is_closed(src)
+        if self.coalescer.rename(src, dest):
+            self.stabilizer.forget(src)
+            self.held.discard(src)
+            self.stabilizer.track(dest, self.on_stable)
+        else:
+            # e.g. Firefox renaming foo.part => foo once the download is done.
+            self.handle_created(dest_path)
+        if finished:
+            self.stabilizer.closed(dest)
+
+    def on_stable(self, file_path, historical_size):
+        """Queue a stabilized file for the handlers."""
+        if file_path not in self.held:
+            logger.info(f"File {file_path} has stabilized at {historical_size}")
+
+        if historical_size < 1 or not self.coalescer.activate(file_path):
+            self.coalescer.discard(file_path)
+            self.held.discard(file_path)
+            return
 
-            for path in cmdline:
-                if process_name == path:
-                    msg = f"daemon already running (pid {process.pid}), exiting..."
-                    logger.info(msg)
-                    print(msg, file=sys.stderr)
-                    exit(-2)
+        self.submit(file_path)
 
+    def handle_file(self, file_path):
+        job = None
+        started = time.monotonic()
+        try:
+            job = self.journal.find(file_path) or self.journal.begin(file_path)
+            with logs.job(job.job_id):
+                router = self.router_for(job.detail.get("source", file_path))
+                for handler in router.route(file_path):
+                    handler.process(file_path)
+                self.journal.finish(job.job_id)
+                logger.info(
+                    f"Finished {file_path.name}",
+                    extra={
+                        "path": file_path,
+                        "bytes": job.detail.get("size"),
+                        "seconds": round(time.monotonic() - started, 4),
+                        # Since it stabilized, including time in the queue.
+                        "latency": round(time.time() - job.started, 4),
+                        "status": "done",
+                    },
+                )
+        except Exception as e:
+            logger.error(
+                f"Error handling {file_path}: {e}",
+                extra={
+                    "job": job and job.job_id,
+                    "path": file_path,
+                    "status": "failed",
+                },
+            )
+            logger.exception(e)
+            if job is not None:
+                self.journal.finish(job.job_id, FAILED)
+        finally:
+            self.coalescer.release(file_path)
 
-def setup_logging(foreground=False):
-    """Configure logging handlers. Must be called after DaemonContext."""
-    logger.setLevel(logging.INFO)
-    logger.addHandler(logging.handlers.SysLogHandler(address="/dev/log"))
-    logger.addHandler(logging.FileHandler(os.path.join("/tmp/", f"{NAME}.log"), "a+"))
 
-    if foreground:
-        logger.addHandler(logging.StreamHandler(sys.stderr))
+def setup_logging(foreground=False, fmt=LOG_FORMAT):
+    """Configure logging handlers. Must be called after DaemonContext.
 
+    The listener thread that writes the logs would not survive the fork.
+    """
+    logs.setup(logger, foreground=foreground, fmt=fmt)
 
-def run():
-    """Watch for file events and dispatch to handlers."""
-    w = Watcher(
-        Path("/home/ahonnecke/Downloads/"),
-        Handler(
-            file_handlers=[
+
+def build_router() -> Router:
+    """Routing table for ~/Downloads: first matching rule wins."""
+    return Router(
+        [
+            Rule(
                 ScreenshotHandler(),
-                ImageHandler(),
-                PsarcHandler(),
-                QmkHandler(),
+                suffixes=IMAGE_SUFFIXES,
+                prefix="shot_",
+                priority=10,
+            ),
+            Rule(ImageHandler(), suffixes=IMAGE_SUFFIXES),
+            Rule(PsarcHandler(), suffixes={".psarc"}),
+            Rule(QmkHandler(), suffixes={".bin"}),
+            Rule(
                 FileTypeHandler(
                     file_filter=lambda path: path.suffix == ".stl",
-                    file_handler=lambda path: shutil.move(
+                    file_handler=lambda path: mover.move(
                         path, f"/home/ahonnecke/stl/{path.name}"
                     ),
                 ),
-            ]
+                suffixes={".stl"},
+            ),
+        ],
+        mode=FIRST,
+    )
+
+
+def build_roots() -> List[WatchRoot]:
+    """Directories to watch, each with its own routing table."""
+    return [
+        WatchRoot(
+            "/home/ahonnecke/Downloads/",
+            build_router(),
+            # Browser subfolders and unpacked archives, but not ImageHandler's
+            # destination, failed conversions or hidden/tooling trees.
+            depth=2,
+            exclude=("images", "failed", ".*", "node_modules", "__pycache__"),
         ),
+    ]
+
+
+def start_metrics(port=METRICS_PORT):
+    """Serve metrics on localhost and dump a snapshot on SIGUSR1."""
+    metrics.install_dump_signal()
+    if not port:
+        return
+    try:
+        metrics.serve(port)
+    except OSError as e:
+        logger.error(f"Could not serve metrics on port {port}: {e}")
+
+
+def run(
+    workers=DISPATCH_WORKERS,
+    queue_size=DISPATCH_QUEUE_SIZE,
+    metrics_port=METRICS_PORT,
+):
+    """Watch for file events and dispatch to handlers."""
+    start_metrics(metrics_port)
+    roots = build_roots()
+    handler = Handler(
+        router=roots[0].router,
+        dispatcher=Dispatcher(workers=workers, queue_size=queue_size),
     )
+    w = Watcher(roots, handler)
+    control = ControlServer(handler, reload=build_roots)
+    control.start()
 
     try:
         w.run()
     except RuntimeError as e:
         logger.error("Failed to process file.")
         logger.error(e)
+    finally:
+        control.stop()
+
+
+def backfill(dirpath, workers=DISPATCH_WORKERS):
+    """Run every file in dirpath through the handlers, in parallel."""
+    handler = Handler(
+        router=build_router(),
+        dispatcher=Dispatcher(workers=workers, queue_size=workers * 4),
+    )
+    paths = [
+        Path(entry.path)
+        for entry in os.scandir(dirpath)
+        if entry.is_file(follow_symlinks=False) and not is_partial(Path(entry.name))
+    ]
+    total = len(paths)
+    logger.info(f"Backfilling {total} files from {dirpath} with {workers} workers")
+
+    lock = threading.Lock()
+    done = [0]
+    started = time.monotonic()
+
+    def process(path):
+        handler.handle_file(path)
+        with lock:
+            done[0] += 1
+            count = done[0]
+        if count % 50 == 0 or count == total:
+            rate = count / max(time.monotonic() - started, 1e-6)
+            logger.info(f"Backfill: {count}/{total} files ({rate:.1f}/s)")
+
+    handler.adopt()
+    handler.dispatcher.start()
+    for path in paths:
+        handler.dispatcher.submit(process, path, lane=handler.lane_for(path))
+    handler.dispatcher.shutdown(drain=True)
+    logger.info(f"Backfill finished in {time.monotonic() - started:.1f}s")
 
 
 def main():
@@ -339,15 +722,71 @@ def main():
         default=True,
         help="Run as background daemon.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DISPATCH_WORKERS,
+        help="Number of files processed concurrently.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DISPATCH_QUEUE_SIZE,
+        help="Jobs queued per lane; more wait in the stabilizer.",
+    )
+    parser.add_argument(
+        "--backfill",
+        metavar="DIR",
+        help="Process every file already in DIR, then exit.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="Localhost port for Prometheus metrics (0 disables).",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=logs.FORMATS,
+        default=LOG_FORMAT,
+        help="Log file format; json writes one object per line with job timings.",
+    )
     args = parser.parse_args()
 
+    if args.backfill:
+        setup_logging(foreground=True, fmt=args.log_format)
+        # Absolute: the daemon's working directory is /.
+        paths = [
+            str(Path(entry.path).resolve())
+            for entry in os.scandir(args.backfill)
+            if entry.is_file(follow_symlinks=False) and not is_partial(Path(entry.name))
+        ]
+        try:
+            # Hand the files to the warm daemon if one is running.
+            reply = control_request("enqueue", *paths)
+        except ControlError:
+            backfill(Path(args.backfill), args.workers)
+            return
+        if not reply.get("ok"):
+            print(f"error: {reply.get('error')}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Queued {len(reply['queued'])} files on the running daemon.")
+        return
+
     setproctitle.setproctitle(NAME)
-    ensure_process_is_not_running(NAME)
+    lock = PidLock()
+    try:
+        lock.acquire()
+    except AlreadyRunning as e:
+        print(f"{e}, exiting...", file=sys.stderr)
+        exit(-2)
 
     if args.daemon:
-        with daemon.DaemonContext():
-            setup_logging()
-            run()
+        with daemon.DaemonContext(files_preserve=[lock.file]):
+            lock.write_pid()
+            setup_logging(fmt=args.log_format)
+            run(args.workers, args.queue_size, args.metrics_port)
     else:
-        setup_logging(foreground=True)
-        run()
+        setup_logging(foreground=True, fmt=args.log_format)
+        run(args.workers, args.queue_size, args.metrics_port)
+    lock.release()
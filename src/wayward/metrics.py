@@ -0,0 +1,291 @@
+"""In-process counters, gauges and latency histograms for the daemon.
+
+Metrics are served as Prometheus text on ``http://127.0.0.1:METRICS_PORT/metrics``
+(JSON at ``/metrics.json``) and written to ``METRICS_DUMP`` on SIGUSR1.
+Everything is stdlib; recording a sample is a dict update under a lock.
+"""
+
+import json
+import logging
+import math
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from wayward.config import METRICS_DUMP
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    math.inf,
+)
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in items
+        ]
+
+    def snapshot(self):
+        with self.lock:
+            return {",".join(k) or "": v for k, v in self.values.items()}
+
+
+class Gauge(Counter):
+    """A value that goes up and down, or is read from a function on scrape."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, fn, **labels):
+        with self.lock:
+            self.functions[self._key(labels)] = fn
+
+    def _collect(self):
+        for key, fn in list(self.functions.items()):
+            try:
+                self.set(fn(), **dict(zip(self.labels, key)))
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+
+    def render(self):
+        self._collect()
+        return super().render()
+
+    def snapshot(self):
+        self._collect()
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            items = sorted((k, ([*s[0]], s[1], s[2])) for k, s in self.series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else repr(bound)
+                labels = _format_labels(self.labels, key, ("le", le))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            items = list(self.series.items())
+        out = {}
+        for key, (counts, total, count) in items:
+            out[",".join(key)] = {
+                "count": count,
+                "sum": total,
+                "buckets": {
+                    ("+Inf" if b == math.inf else str(b)): n
+                    for b, n in zip(self.buckets, counts)
+                },
+            }
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            "time": time.time(),
+            "metrics": {m.name: m.snapshot() for m in self.metrics},
+        }
+
+
+REGISTRY = Registry()
+
+EVENTS = REGISTRY.counter(
+    "wayward_events_total", "Filesystem events received", ["type"]
+)
+COALESCED = REGISTRY.counter(
+    "wayward_coalesce_total", "Events by coalescing outcome", ["outcome"]
+)
+STABILIZE_SECONDS = REGISTRY.histogram(
+    "wayward_stabilize_seconds", "Time from first event to stable file"
+)
+QUEUE_DEPTH = REGISTRY.gauge("wayward_queue_depth", "Jobs waiting for a worker")
+PENDING_FILES = REGISTRY.gauge("wayward_pending_files", "Files being stabilized")
+HANDLER_SECONDS = REGISTRY.histogram(
+    "wayward_handler_seconds", "FileTypeHandler latency", ["handler"]
+)
+HANDLER_FAILURES = REGISTRY.counter(
+    "wayward_handler_failures_total", "Handler runs that raised", ["handler"]
+)
+MOVE_SECONDS = REGISTRY.histogram(
+    "wayward_move_seconds", "File moves, by rename or copy", ["kind"]
+)
+MOVE_BYTES = REGISTRY.counter(
+    "wayward_move_bytes_total", "Bytes moved, by rename or copy", ["kind"]
+)
+SUBPROCESS_SECONDS = REGISTRY.histogram(
+    "wayward_subprocess_seconds", "Time spent in external tools", ["tool"]
+)
+SUBPROCESS_FAILURES = REGISTRY.counter(
+    "wayward_subprocess_failures_total", "External tool failures", ["tool"]
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.registry.render().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(self.registry.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """Start the metrics endpoint on a background thread; returns the server."""
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="wayward-metrics", daemon=True
+    ).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def dump(path=METRICS_DUMP, registry=REGISTRY):
+    with open(path, "w") as f:
+        json.dump(registry.snapshot(), f, indent=2)
+    logger.info(f"Wrote metrics snapshot to {path}")
+
+
+def install_dump_signal(path=METRICS_DUMP, signum=signal.SIGUSR1):
+    """Dump a JSON snapshot whenever the daemon receives signum."""
+    signal.signal(signum, lambda *_: dump(path))
@@ -0,0 +1,208 @@
+"""Move files onto the NAS without ever exposing a half-written copy.
+
+Same-filesystem moves are a plain rename. Cross-filesystem moves stream into
+a hidden ``.<name>.wayward-part`` file next to the destination, fsync it and
+rename it into place, so readers of ``staging/`` or ``live/`` only ever see
+whole files. The copy uses ``MOVE_BUFFER``-sized reads and hashes the bytes
+as they pass; with ``hash=False`` it hands the copy to the kernel with
+``copy_file_range`` instead. A temp file left by an interrupted copy is
+resumed from where it stopped rather than started over.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from wayward.config import MOVE_BUFFER
+from wayward.metrics import MOVE_BYTES, MOVE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".wayward-part"
+# Tail of a resumed temp file compared against the source before trusting it.
+RESUME_CHECK = 1024 * 1024
+
+
+class MoveError(RuntimeError):
+    pass
+
+
+class MoveResult(NamedTuple):
+    source: Path
+    dest: Path
+    size: int
+    seconds: float
+    renamed: bool
+    hash: Optional[str] = None
+    resumed: int = 0
+
+
+def temp_path(dest: Path) -> Path:
+    return dest.with_name(f".{dest.name}{PART_SUFFIX}")
+
+
+def same_device(src: Path, dest_dir: Path) -> bool:
+    return os.stat(src).st_dev == os.stat(dest_dir).st_dev
+
+
+def move(src, dest, hash=True, verify=False) -> MoveResult:
+    """Move src to dest (a file path or an existing directory).
+
+    ``hash`` returns the sha256 of the content when the move had to copy it;
+    ``verify`` re-reads the destination and compares before deleting src.
+    """
+    src = Path(src)
+    dest = Path(dest)
+    if dest.is_dir():
+        dest = dest / src.name
+    started = time.monotonic()
+
+    if same_device(src, dest.parent):
+        size = src.stat().st_size
+        os.rename(src, dest)
+        result = MoveResult(src, dest, size, time.monotonic() - started, True)
+    else:
+        result = _copy_move(src, dest, hash, verify, started)
+
+    kind = "rename" if result.renamed else "copy"
+    MOVE_SECONDS.observe(result.seconds, kind=kind)
+    MOVE_BYTES.inc(result.size - result.resumed, kind=kind)
+    logger.debug(
+        f"Moved {src} => {dest} ({kind}, {result.seconds:.2f}s)",
+        extra={
+            "path": src,
+            "dest": dest,
+            "bytes": result.size,
+            "seconds": round(result.seconds, 4),
+        },
+    )
+    return result
+
+
+def _copy_move(src, dest, hash, verify, started) -> MoveResult:
+    temp = temp_path(dest)
+    size = src.stat().st_size
+    digest = hashlib.sha256() if hash or verify else None
+
+    with open(src, "rb") as fsrc:
+        offset = _resume_offset(fsrc, temp, size, digest)
+        with open(temp, "r+b" if offset else "wb") as fdst:
+            fdst.seek(offset)
+            if digest is None:
+                _copy_range(fsrc, fdst, offset, size)
+            else:
+                _copy_hashing(fsrc, fdst, digest)
+            fdst.truncate(size)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+    hexdigest = digest.hexdigest() if digest else None
+    if verify and _hash(temp) != hexdigest:
+        temp.unlink()
+        raise MoveError(f"Copy of {src} to {dest} did not verify, source kept")
+
+    shutil.copystat(src, temp)
+    os.rename(temp, dest)
+    _fsync_dir(dest.parent)
+    src.unlink()
+    if offset:
+        logger.info(f"Resumed copy of {src.name} at {offset} of {size} bytes")
+    return MoveResult(
+        src, dest, size, time.monotonic() - started, False, hexdigest, offset
+    )
+
+
+def _resume_offset(fsrc, temp, size, digest) -> int:
+    """Bytes of temp that can be kept from an earlier, interrupted copy."""
+    try:
+        have = temp.stat().st_size
+    except FileNotFoundError:
+        return 0
+    if have == 0 or have > size:
+        return 0
+    check = min(have, RESUME_CHECK)
+    fsrc.seek(have - check)
+    with open(temp, "rb") as fold:
+        fold.seek(have - check)
+        if fold.read(check) != fsrc.read(check):
+            logger.warning(f"Discarding stale partial copy {temp}")
+            return 0
+    fsrc.seek(0)
+    if digest is not None:
+        # The hash covers the whole file, so read back the source prefix.
+        _feed(fsrc, digest, have)
+    fsrc.seek(have)
+    return have
+
+
+def _feed(f, digest, length):
+    while length > 0:
+        chunk = f.read(min(MOVE_BUFFER, length))
+        if not chunk:
+            break
+        digest.update(chunk)
+        length -= len(chunk)
+
+
+def _copy_hashing(fsrc, fdst, digest):
+    buffer = bytearray(MOVE_BUFFER)
+    view = memoryview(buffer)
+    while n := fsrc.readinto(buffer):
+        digest.update(view[:n])
+        fdst.write(view[:n])
+
+
+def _copy_range(fsrc, fdst, offset, size):
+    """Copy [offset, size) in the kernel, falling back to a buffered loop."""
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        try:
+            while offset < size:
+                n = copy_file_range(
+                    fsrc.fileno(),
+                    fdst.fileno(),
+                    min(MOVE_BUFFER, size - offset),
+                    offset,
+                    offset,
+                )
+                if n == 0:
+                    break
+                offset += n
+            return
+        except OSError as e:
+            if e.errno not in (
+                errno.EXDEV,
+                errno.ENOSYS,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+            ):
+                raise
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    shutil.copyfileobj(fsrc, fdst, MOVE_BUFFER)
+
+
+def _hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        _feed(f, digest, os.fstat(f.fileno()).st_size)
+    return digest.hexdigest()
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Not every filesystem (or NFS server) supports fsync on a directory.
+        pass
+    finally:
+        os.close(fd)
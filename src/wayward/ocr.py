@@ -0,0 +1,145 @@
+"""Process pool of warm tesseract workers for OCRing images inside the daemon.
+
+Each worker imports PIL and pytesseract once at startup, so a job costs one
+tesseract run instead of a fresh interpreter. Images can be converted to
+grayscale and capped at ``OCR_MAX_DIMENSION`` pixels first, which speeds up
+recognition of large screenshots without hurting text accuracy much.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import NamedTuple, Optional
+
+from wayward.config import (
+    OCR_CACHE_VERSION,
+    OCR_GRAYSCALE,
+    OCR_MAX_DIMENSION,
+    OCR_TIMEOUT,
+    OCR_WORKERS,
+)
+from wayward.metrics import SUBPROCESS_FAILURES, SUBPROCESS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class OcrResult(NamedTuple):
+    path: str
+    text: str
+    seconds: float
+    error: Optional[str] = None
+
+
+def _init_worker():
+    # Pay the import cost once per worker, not once per image. A missing
+    # dependency is reported per job instead of breaking the pool.
+    try:
+        _load()
+    except ImportError:
+        pass
+
+
+def _load():
+    global Image, pytesseract
+    from PIL import Image
+    import pytesseract
+
+
+def _recognize(path, grayscale, max_dimension, timeout) -> OcrResult:
+    started = time.monotonic()
+    try:
+        _load()
+        with Image.open(path) as image:
+            if grayscale:
+                image = image.convert("L")
+            if max_dimension and max(image.size) > max_dimension:
+                image.thumbnail((max_dimension, max_dimension))
+            text = pytesseract.image_to_string(image, timeout=timeout)
+    except Exception as e:
+        return OcrResult(
+            path, "", time.monotonic() - started, f"{type(e).__name__}: {e}"
+        )
+    return OcrResult(path, text.strip(), time.monotonic() - started)
+
+
+def _record(result) -> OcrResult:
+    SUBPROCESS_SECONDS.observe(result.seconds, tool="tesseract")
+    if result.error:
+        SUBPROCESS_FAILURES.inc(tool="tesseract")
+    return result
+
+
+class OcrPool:
+    def __init__(
+        self,
+        workers=OCR_WORKERS,
+        timeout=OCR_TIMEOUT,
+        grayscale=OCR_GRAYSCALE,
+        max_dimension=OCR_MAX_DIMENSION,
+    ):
+        self.timeout = timeout
+        self.grayscale = grayscale
+        self.max_dimension = max_dimension
+        # spawn, not fork: the daemon is multi-threaded by the time OCR starts.
+        self.executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    @property
+    def version(self) -> str:
+        """Cache stamp: changes whenever settings that affect the text change."""
+        return f"{OCR_CACHE_VERSION}:gray={self.grayscale}:max={self.max_dimension}"
+
+    def submit(self, path):
+        """Queue an image; returns a Future of OcrResult."""
+        return self.executor.submit(
+            _recognize, str(path), self.grayscale, self.max_dimension, self.timeout
+        )
+
+    def ocr(self, path) -> OcrResult:
+        """OCR one image, giving up after twice the tesseract timeout.
+
+        Giving up only drops a job that hasn't started. One already running
+        keeps its worker busy until tesseract's own timeout kills it.
+        """
+        future = self.submit(path)
+        try:
+            # tesseract enforces the timeout itself; the slack covers queueing.
+            return _record(future.result(self.timeout * 2))
+        except FutureTimeout:
+            future.cancel()
+            return _record(
+                OcrResult(str(path), "", float(self.timeout * 2), "timed out")
+            )
+
+    def map(self, paths):
+        """OCR many images in parallel, yielding results as they finish.
+
+        Results come back in completion order; match them up by ``path``.
+        """
+        futures = [self.submit(path) for path in paths]
+        for future in as_completed(futures):
+            yield _record(future.result())
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> OcrPool:
+    """Return the process-wide OCR pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OcrPool()
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -11,12 +11,13 @@ NAME = "ocr_image"
 logger = logging.getLogger(NAME)
 
 
-def generate_ocr_image(image_path: Path, output_path: Path):
+def generate_ocr_image(image_path: Path, output_path: Path) -> str:
     ocr = pytesseract.image_to_string(str(image_path))
 
     with open(output_path, "w") as f:
         f.write(ocr)
     logger.info(f"OCR saved to {output_path}")
+    return ocr
 
 
 def main(image_path: Path, output_path: Path):
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""Near-duplicate images by perceptual hash, checked as images are filed.
+
+Each image gets a 64-bit dHash: it is shrunk to 9x8 grayscale and every bit
+says whether a pixel is brighter than its right-hand neighbour. Re-encodes,
+resizes and small edits change only a few bits, so two images are
+near-duplicates when their hashes are within ``PHASH_DISTANCE`` bits.
+
+Hashes live in SQLite and are looked up by multi-index hashing. Each hash is
+stored as four 16-bit chunks, each with its own index. If two hashes differ
+in at most d bits, at least one chunk differs in at most d // 4 of them. So
+a lookup probes each chunk index for the few values within that radius,
+then checks the real distance on that small candidate set. Its cost grows
+with the number of near matches, not with the size of the archive.
+
+Pillow is only needed to compute hashes; it is imported on first use.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import combinations
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from wayward import mover
+from wayward.config import (
+    IMAGE_SUFFIXES,
+    PHASH_ACTION,
+    PHASH_DB,
+    PHASH_DISTANCE,
+    PHASH_DUPLICATES,
+    SEARCH_ROOTS,
+)
+
+logger = logging.getLogger(__name__)
+
+FLAG = "flag"
+LINK = "link"
+SKIP = "skip"
+ACTIONS = (FLAG, LINK, SKIP)
+
+BITS = 64
+CHUNKS = 4
+CHUNK_BITS = BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+class PhashError(RuntimeError):
+    pass
+
+
+class Match(NamedTuple):
+    path: str
+    hash: int
+    distance: int
+
+
+class Ingested(NamedTuple):
+    path: Path
+    hash: Optional[int]
+    match: Optional[Match]
+    skipped: bool = False
+
+
+def dhash(path, size=8) -> int:
+    """64-bit difference hash of the image at path."""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise PhashError("perceptual hashing needs Pillow")
+    try:
+        with Image.open(path) as image:
+            pixels = list(
+                image.convert("L").resize((size + 1, size), Image.LANCZOS).getdata()
+            )
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        # Broken headers raise SyntaxError, oversized images DecompressionBombError.
+        raise PhashError(f"can't read {path}: {e}")
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def chunks(value: int) -> List[int]:
+    return [(value >> (CHUNK_BITS * n)) & CHUNK_MASK for n in range(CHUNKS)]
+
+
+def _within(chunk: int, radius: int) -> List[int]:
+    """Every CHUNK_BITS-bit value within radius bits of chunk."""
+    found = [chunk]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            found.append(flipped)
+    return found
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64-bit.
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << BITS) if value < 0 else value
+
+
+class ImageIndex:
+    def __init__(self, path=PHASH_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                hash INTEGER NOT NULL,
+                c0 INTEGER NOT NULL,
+                c1 INTEGER NOT NULL,
+                c2 INTEGER NOT NULL,
+                c3 INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                duplicate_of TEXT
+            );
+            CREATE INDEX IF NOT EXISTS images_c0 ON images (c0);
+            CREATE INDEX IF NOT EXISTS images_c1 ON images (c1);
+            CREATE INDEX IF NOT EXISTS images_c2 ON images (c2);
+            CREATE INDEX IF NOT EXISTS images_c3 ON images (c3);
+            """
+        )
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            try:
+                yield self.db
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def add(self, path, value, duplicate_of=None):
+        path = Path(path)
+        st = path.stat()
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    _signed(value),
+                    *chunks(value),
+                    st.st_size,
+                    st.st_mtime_ns,
+                    str(duplicate_of) if duplicate_of else None,
+                ),
+            )
+
+    def remove(self, path):
+        with self.transaction() as db:
+            db.execute("DELETE FROM images WHERE path = ?", (str(path),))
+
+    def get(self, path) -> Optional[int]:
+        """The stored hash, if path hasn't changed since it was indexed."""
+        path = Path(path)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash, size, mtime_ns FROM images WHERE path = ?", (str(path),)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        if (st.st_size, st.st_mtime_ns) != (row[1], row[2]):
+            return None
+        return _unsigned(row[0])
+
+    def nearest(self, value, distance=PHASH_DISTANCE, exclude=None) -> List[Match]:
+        """Indexed images within distance bits of value, closest first."""
+        radius = distance // CHUNKS
+        candidates = {}
+        with self.lock:
+            for n, chunk in enumerate(chunks(value)):
+                probes = _within(chunk, radius)
+                rows = self.db.execute(
+                    f"SELECT path, hash FROM images WHERE c{n} IN "
+                    f"({', '.join('?' * len(probes))})",
+                    probes,
+                )
+                for path, stored in rows:
+                    candidates[path] = _unsigned(stored)
+        matches = [
+            Match(path, stored, hamming(value, stored))
+            for path, stored in candidates.items()
+            if path != str(exclude)
+        ]
+        return sorted(
+            (m for m in matches if m.distance <= distance),
+            key=lambda m: (m.distance, m.path),
+        )
+
+    def closest(self, value, distance=PHASH_DISTANCE, exclude=None) -> Optional[Match]:
+        """The nearest match whose file still exists; drops stale entries."""
+        for match in self.nearest(value, distance, exclude):
+            if Path(match.path).exists():
+                return match
+            self.remove(match.path)
+        return None
+
+    def paths(self) -> List[str]:
+        """Every indexed path, oldest file first."""
+        with self.lock:
+            rows = self.db.execute("SELECT path FROM images ORDER BY mtime_ns, path")
+            return [row[0] for row in rows]
+
+    def hash_of(self, path) -> Optional[int]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash FROM images WHERE path = ?", (str(path),)
+            ).fetchone()
+        return _unsigned(row[0]) if row else None
+
+
+def link_to(original, path):
+    """Replace path with a hard link to original (a symlink across devices)."""
+    original = Path(original)
+    path = Path(path)
+    temp = path.with_name(f".{path.name}.wayward-link")
+    temp.unlink(missing_ok=True)
+    try:
+        os.link(original, temp)
+    except OSError:
+        temp.symlink_to(original.resolve())
+    os.replace(temp, path)
+
+
+def ingest(
+    path, dest, action=PHASH_ACTION, index=None, distance=PHASH_DISTANCE
+) -> Ingested:
+    """Move an incoming image to dest, handling a near-duplicate per action.
+
+    Images that can't be hashed are filed as usual.
+    """
+    path = Path(path)
+    if index is None:
+        index = get_image_index()
+    try:
+        value = dhash(path)
+    except PhashError as e:
+        logger.warning(f"Not checking {path.name} for duplicates: {e}")
+        return Ingested(mover.move(path, dest).dest, None, None)
+
+    match = index.closest(value, distance)
+    if match is not None and action == SKIP:
+        PHASH_DUPLICATES.mkdir(parents=True, exist_ok=True)
+        held = mover.move(path, PHASH_DUPLICATES / path.name).dest
+        logger.info(
+            f"Skipped {path.name}: near-duplicate of {match.path} "
+            f"({match.distance} bits), parked in {held}"
+        )
+        return Ingested(held, value, match, skipped=True)
+
+    moved = mover.move(path, dest).dest
+    if match is not None:
+        logger.info(
+            f"{moved.name} is a near-duplicate of {match.path} ({match.distance} bits)"
+        )
+        if action == LINK:
+            link_to(match.path, moved)
+    index.add(moved, value, duplicate_of=match.path if match else None)
+    return Ingested(moved, value, match)
+
+
+def _hash_one(path):
+    try:
+        return path, dhash(path), None
+    except PhashError as e:
+        return path, None, str(e)
+
+
+def index_tree(index, roots, workers=None) -> int:
+    """Hash every new or changed image under roots; returns how many."""
+    todo = []
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            # Parked duplicates would only match their originals again.
+            if Path(dirpath) == PHASH_DUPLICATES:
+                dirnames.clear()
+                continue
+            todo.extend(
+                str(Path(dirpath) / filename)
+                for filename in filenames
+                if Path(filename).suffix.lower() in IMAGE_SUFFIXES
+                and not filename.startswith(".")
+            )
+    todo = [path for path in todo if index.get(path) is None]
+    if not todo:
+        return 0
+    done = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        for path, value, error in pool.map(_hash_one, todo, chunksize=32):
+            if error:
+                logger.warning(error)
+                continue
+            index.add(path, value)
+            done += 1
+            if done % 500 == 0:
+                logger.info(f"Hashed {done}/{len(todo)} images")
+    return done
+
+
+def duplicate_groups(index, distance=PHASH_DISTANCE) -> List[List[Match]]:
+    """Clusters of near-duplicates; the first of each is its oldest file."""
+    seen = set()
+    groups = []
+    for path in index.paths():
+        if path in seen or not Path(path).exists():
+            continue
+        value = index.hash_of(path)
+        group = [Match(path, value, 0)]
+        seen.add(path)
+        # Grow the cluster through near matches of its members.
+        frontier = [value]
+        while frontier:
+            for match in index.nearest(frontier.pop(), distance):
+                if match.path in seen or not Path(match.path).exists():
+                    continue
+                seen.add(match.path)
+                group.append(match._replace(distance=hamming(value, match.hash)))
+                frontier.append(match.hash)
+        if len(group) > 1:
+            groups.append(group)
+    return groups
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_image_index() -> ImageIndex:
+    """Return the process-wide perceptual-hash index, opening it on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ImageIndex()
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find near-duplicate images across the archive."
+    )
+    parser.add_argument(
+        "dirs",
+        nargs="*",
+        help=f"Trees to index first (default: {', '.join(map(str, SEARCH_ROOTS))})",
+    )
+    parser.add_argument("--distance", type=int, default=PHASH_DISTANCE)
+    parser.add_argument(
+        "--action",
+        choices=("report", LINK, "move"),
+        default="report",
+        help="What to do with every copy but the oldest",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--json", action="store_true", help="Print groups as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    index = ImageIndex()
+    try:
+        added = index_tree(index, args.dirs or SEARCH_ROOTS, args.workers)
+    except PhashError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    print(f"Indexed {added} new images ({len(index)} total).", file=sys.stderr)
+
+    groups = duplicate_groups(index, args.distance)
+    extra = 0
+    for original, *copies in groups:
+        if args.json:
+            print(json.dumps([m._asdict() for m in (original, *copies)]))
+        else:
+            print(original.path)
+        for copy in copies:
+            extra += 1
+            if not args.json:
+                print(f"  {copy.distance:2d}  {copy.path}")
+            if args.action == LINK:
+                link_to(original.path, copy.path)
+                index.add(copy.path, copy.hash, duplicate_of=original.path)
+            elif args.action == "move":
+                PHASH_DUPLICATES.mkdir(parents=True, exist_ok=True)
+                mover.move(copy.path, PHASH_DUPLICATES / Path(copy.path).name)
+                index.remove(copy.path)
+    print(f"{len(groups)} groups, {extra} near-duplicates.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,77 +2,150 @@
 """Move CDLC files from staging to live on the NAS, then sync _m.psarc to rocksmithytoo."""
 
 import argparse
-import shutil
-import subprocess
 import sys
-
-from wayward.config import LIVE, REMOTE_DLC, REMOTE_HOST, STAGING
-
-
-def scp_to_remote(filename: str):
-    """SCP a single _m.psarc file to the rocksmithytoo Steam DLC dir."""
-    if not filename.endswith("_m.psarc"):
-        return
-    src = LIVE / filename
-    dest = f"{REMOTE_HOST}:{REMOTE_DLC}"
-    result = subprocess.run(
-        ["scp", str(src), dest],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode == 0:
-        print(f"  synced to rocksmithytoo: {filename}")
-    else:
-        print(f"  scp failed for {filename}: {result.stderr.strip()}", file=sys.stderr)
-
-
-def sync_all():
-    """Rsync all _m.psarc files from live/ to rocksmithytoo Steam DLC dir."""
-    src = str(LIVE) + "/"
-    dest = f"{REMOTE_HOST}:{REMOTE_DLC}"
-    cmd = [
-        "rsync",
-        "-av",
-        "--progress",
-        "--include=*_m.psarc",
-        "--exclude=*",
-        src,
-        dest,
-    ]
-    print(f"Syncing _m.psarc files from {LIVE} to rocksmithytoo...")
-    result = subprocess.run(cmd)
-    if result.returncode != 0:
-        print("rsync failed", file=sys.stderr)
+from typing import NamedTuple
+
+from wayward.cache import hash_file
+from wayward.catalog import get_catalog
+from wayward.config import LIVE, STAGING
+from wayward.mover import move
+from wayward.psarc import summary
+from wayward.transport import (
+    TransportError,
+    get_transport,
+    remove_from_remote,
+    sync_to_remote,
+)
+
+
+class SyncPlan(NamedTuple):
+    missing: list
+    changed: list
+    orphans: list
+    unchanged: list
+    adopted: list
+
+
+def plan_sync(local, remote, manifest) -> SyncPlan:
+    """Diff live/ against the remote listing and what we last pushed.
+
+    ``local`` maps name to catalog Entry, ``remote`` name to size and
+    ``manifest`` name to the Pushed record. Each live file is stat'ed afresh,
+    since one replaced in place may not have moved its directory's mtime, and
+    files are only hashed when their mtime moved since the last push.
+    """
+    plan = SyncPlan([], [], sorted(set(remote) - set(local)), [], [])
+    catalog = get_catalog()
+    for name, entry in sorted(local.items()):
+        try:
+            st = (LIVE / name).stat()
+        except FileNotFoundError:
+            catalog.record_remove("live", name)
+            if name in remote:
+                plan.orphans.append(name)
+            continue
+        if (st.st_size, st.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            # Stale row: record the new size and mtime and drop the hash.
+            catalog.record_add("live", LIVE / name)
+            entry = entry._replace(size=st.st_size, mtime_ns=st.st_mtime_ns, hash=None)
+        if name not in remote:
+            plan.missing.append(name)
+            continue
+        if remote[name] != entry.size:
+            plan.changed.append(name)
+            continue
+        pushed = manifest.get(name)
+        if pushed is None:
+            # On the Mac already (e.g. from the old rsync); trust the size.
+            plan.adopted.append(name)
+        elif (pushed.size, pushed.mtime_ns) == (entry.size, entry.mtime_ns):
+            plan.unchanged.append(name)
+        else:
+            digest = entry.hash or hash_file(LIVE / name)
+            catalog.set_hash("live", name, digest)
+            if pushed.hash and pushed.hash != digest:
+                plan.changed.append(name)
+            else:
+                plan.adopted.append(name)
+    plan.orphans.sort()
+    return plan
+
+
+def sync_all(delete=False, verify=False):
+    """Push missing or changed _m.psarc files from live/ to rocksmithytoo."""
+    catalog = get_catalog()
+    transport = get_transport()
+    local = {e.name: e for e in catalog.list("live") if e.name.endswith("_m.psarc")}
+    try:
+        remote = transport.listing()
+    except TransportError as e:
+        print(f"Could not list rocksmithytoo: {e}", file=sys.stderr)
         sys.exit(1)
+    plan = plan_sync(local, remote, catalog.manifest())
+
+    if verify:
+        for label, names in (
+            ("missing", plan.missing),
+            ("changed", plan.changed),
+            ("orphan", plan.orphans),
+        ):
+            for name in names:
+                print(f"{label}: {name}")
+        drift = len(plan.missing) + len(plan.changed) + len(plan.orphans)
+        print(
+            f"{drift} files differ, {len(plan.unchanged) + len(plan.adopted)} in sync."
+        )
+        sys.exit(1 if drift else 0)
+
+    catalog.record_pushed(plan.adopted)
+    to_push = plan.missing + plan.changed
+    if to_push:
+        print(f"Pushing {len(to_push)} _m.psarc files to rocksmithytoo...")
+        sync_to_remote(to_push, transport)
+    if delete and plan.orphans:
+        print(f"Removing {len(plan.orphans)} orphans from rocksmithytoo...")
+        remove_from_remote(plan.orphans, transport)
+    elif plan.orphans:
+        print(f"{len(plan.orphans)} files on rocksmithytoo are not in live/ (--delete)")
     print("Sync complete.")
 
 
 def list_staging():
-    files = sorted(STAGING.glob("*.psarc"))
+    catalog = get_catalog()
+    files = catalog.list("staging")
     if not files:
         print("No files in staging.")
         return
+    width = max(len(f.name) for f in files)
     for f in files:
-        print(f.name)
+        print(f"{f.name:<{width}}  {summary(catalog.song('staging', f.name))}".rstrip())
 
 
 def promote(filenames: list[str]):
+    catalog = get_catalog()
+    promoted = []
     for name in filenames:
-        src = STAGING / name
-        if not src.exists():
+        if catalog.get("staging", name) is None:
             print(f"Not found in staging: {name}", file=sys.stderr)
             continue
-        dest = LIVE / name
-        if dest.exists():
+        # The catalog can lag a copy made behind wayward's back.
+        if catalog.get("live", name) is not None or (LIVE / name).exists():
             print(f"Already in live (skipping): {name}", file=sys.stderr)
             continue
-        shutil.move(str(src), str(dest))
+        try:
+            move(STAGING / name, LIVE / name)
+        except FileNotFoundError:
+            catalog.record_remove("staging", name)
+            print(f"Not found in staging: {name}", file=sys.stderr)
+            continue
+        catalog.record_move(name, "staging", "live")
         print(f"Promoted: {name}")
-        scp_to_remote(name)
+        promoted.append(name)
+    sync_to_remote(promoted)
 
 
 def promote_all():
-    files = list(STAGING.glob("*.psarc"))
+    files = get_catalog().list("staging")
     if not files:
         print("No files in staging.")
         return
@@ -89,12 +162,29 @@ def main():
     parser.add_argument(
         "--sync",
         action="store_true",
-        help="Rsync all _m.psarc from live/ to rocksmithytoo Steam DLC dir",
+        help="Push missing/changed _m.psarc from live/ to rocksmithytoo Steam DLC dir",
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="With --sync, remove files on rocksmithytoo that are not in live/",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Report drift between live/ and rocksmithytoo without transferring",
+    )
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="Re-read staging/live/quarantine into the catalog",
     )
     args = parser.parse_args()
 
-    if args.sync:
-        sync_all()
+    if args.rescan:
+        print(f"Catalog updated {get_catalog().refresh(force=True)} entries.")
+    elif args.sync or args.verify:
+        sync_all(delete=args.delete, verify=args.verify)
     elif args.list:
         list_staging()
     elif args.all:
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""Read song metadata straight out of a Rocksmith 2014 PSARC archive.
+
+The archive is mmapped and only three things are read: the 32-byte header,
+the table of contents (AES-256-CFB encrypted with the well-known Rocksmith
+key, which needs the optional ``cryptography`` package), and the few small
+``manifests/*.json`` entries, inflated block by block with zlib. Audio and
+note data are never touched, so reading a song's artist, title, album,
+arrangements and tuning costs a few kilobytes of I/O even over NFS.
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import re
+import struct
+import sys
+import zlib
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PSAR"
+HEADER = struct.Struct(">4sI4sIIIII")
+TOC_ENTRY_SIZE = 30
+FLAG_TOC_ENCRYPTED = 4
+TOC_KEY = bytes.fromhex(
+    "C53DB23870A1A2F71CAE64061FDD0E1157309DC85204D4C5BFDF25090DF2572C"
+)
+
+# String offsets from E standard, low string first.
+TUNINGS = {
+    (0, 0, 0, 0, 0, 0): "E Standard",
+    (-1, -1, -1, -1, -1, -1): "Eb Standard",
+    (-2, -2, -2, -2, -2, -2): "D Standard",
+    (-3, -3, -3, -3, -3, -3): "C# Standard",
+    (-4, -4, -4, -4, -4, -4): "C Standard",
+    (-5, -5, -5, -5, -5, -5): "B Standard",
+    (-2, 0, 0, 0, 0, 0): "Drop D",
+    (-3, -1, -1, -1, -1, -1): "Eb Drop Db",
+    (-4, -2, -2, -2, -2, -2): "D Drop C",
+    (-5, -3, -3, -3, -3, -3): "C# Drop B",
+    (-2, -2, 0, 0, 0, -2): "Open G",
+    (-2, 0, 0, -1, -2, -2): "Open D",
+    (0, 2, 2, 1, 0, 0): "Open E",
+}
+
+# Rocksmith's own "Artist_Title_v1_p" naming: keep the version and platform.
+NAME_TAIL = re.compile(r"((?:_v\d+(?:_\d+)*)?(?:_[mp])?)\.psarc$", re.IGNORECASE)
+
+
+class PsarcError(RuntimeError):
+    pass
+
+
+class TocEntry(NamedTuple):
+    name: str
+    zindex: int
+    length: int
+    offset: int
+
+
+class SongInfo(NamedTuple):
+    artist: str
+    title: str
+    album: str
+    year: Optional[int]
+    arrangements: Tuple[str, ...]
+    tuning: str
+
+
+def tuning_name(tuning: dict, strings=6) -> str:
+    offsets = tuple(int(tuning.get(f"string{n}", 0)) for n in range(6))
+    if strings == 4:
+        # Bass: name it after the guitar tuning its four strings match.
+        offsets = offsets[:4] + offsets[3:4] * 2
+    name = TUNINGS.get(offsets)
+    return name or "Custom (" + " ".join(str(o) for o in offsets[:strings]) + ")"
+
+
+def _decrypt_toc(data: bytes) -> bytes:
+    try:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+    except ImportError:
+        raise PsarcError("reading encrypted PSARC tables needs 'cryptography'")
+    try:
+        from cryptography.hazmat.decrepit.ciphers.modes import CFB
+    except ImportError:
+        # Older cryptography releases only have it in the main modes module.
+        from cryptography.hazmat.primitives.ciphers.modes import CFB
+    decryptor = Cipher(algorithms.AES(TOC_KEY), CFB(bytes(16))).decryptor()
+    return decryptor.update(data) + decryptor.finalize()
+
+
+class PsarcReader:
+    """Random access to the entries of one PSARC file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except (struct.error, ValueError, IndexError, zlib.error) as e:
+            self.close()
+            raise PsarcError(f"{self.path.name}: malformed PSARC ({e})")
+        except PsarcError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    @property
+    def names(self):
+        return list(self.entries)
+
+    def _parse(self):
+        (
+            magic,
+            _version,
+            compression,
+            toc_length,
+            entry_size,
+            count,
+            self.block_size,
+            flags,
+        ) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise PsarcError(f"{self.path.name}: not a PSARC file")
+        if compression != b"zlib" or entry_size != TOC_ENTRY_SIZE:
+            raise PsarcError(f"{self.path.name}: unsupported PSARC layout")
+
+        toc = bytes(self.map[HEADER.size : toc_length])
+        if flags & FLAG_TOC_ENCRYPTED:
+            toc = _decrypt_toc(toc)
+
+        raw = []
+        for n in range(count):
+            record = toc[n * entry_size : (n + 1) * entry_size]
+            raw.append(
+                (
+                    struct.unpack(">I", record[16:20])[0],
+                    int.from_bytes(record[20:25], "big"),
+                    int.from_bytes(record[25:30], "big"),
+                )
+            )
+
+        width = 1
+        while 256**width < self.block_size:
+            width += 1
+        table = toc[count * entry_size :]
+        self.zlengths = [
+            int.from_bytes(table[i : i + width], "big")
+            for i in range(0, len(table) - width + 1, width)
+        ]
+
+        # Entry 0 is the newline-separated list of names for the rest.
+        listing = self._inflate(*raw[0]).decode("utf-8", "replace")
+        names = listing.replace("\r", "").split("\n")
+        self.entries = {
+            name: TocEntry(name, *fields) for name, fields in zip(names, raw[1:])
+        }
+
+    def _inflate(self, zindex, length, offset) -> bytes:
+        out = bytearray()
+        position = offset
+        block = zindex
+        while len(out) < length:
+            zlength = self.zlengths[block]
+            block += 1
+            if zlength == 0:
+                # A full block stored uncompressed.
+                out += self.map[position : position + self.block_size]
+                position += self.block_size
+                continue
+            chunk = self.map[position : position + zlength]
+            position += zlength
+            try:
+                out += zlib.decompress(chunk)
+            except zlib.error:
+                out += chunk
+        return bytes(out[:length])
+
+    def read(self, name) -> bytes:
+        entry = self.entries.get(name)
+        if entry is None:
+            raise KeyError(name)
+        return self._inflate(entry.zindex, entry.length, entry.offset)
+
+    def manifests(self):
+        """Yield the Attributes of every arrangement manifest."""
+        for name in self.entries:
+            if not (name.startswith("manifests/") and name.endswith(".json")):
+                continue
+            try:
+                document = json.loads(self.read(name))
+            except ValueError:
+                logger.debug(f"{self.path.name}: unreadable manifest {name}")
+                continue
+            for entry in document.get("Entries", {}).values():
+                attributes = entry.get("Attributes")
+                if attributes:
+                    yield attributes
+
+    def metadata(self) -> SongInfo:
+        attributes = list(self.manifests())
+        if not attributes:
+            raise PsarcError(f"{self.path.name}: no song manifests")
+        first = next(
+            (a for a in attributes if "Vocals" not in (a.get("ArrangementName") or "")),
+            attributes[0],
+        )
+        arrangements = []
+        tuning = None
+        for attrs in attributes:
+            name = attrs.get("ArrangementName") or "?"
+            if name not in arrangements:
+                arrangements.append(name)
+            if tuning is None and name not in ("Vocals", "JVocals", "Bass"):
+                tuning = tuning_name(attrs.get("Tuning") or {})
+        if tuning is None:
+            bass = next((a for a in attributes if a.get("Tuning")), None)
+            tuning = tuning_name(bass["Tuning"], strings=4) if bass else "Unknown"
+        year = first.get("SongYear")
+        return SongInfo(
+            artist=(first.get("ArtistName") or "").strip(),
+            title=(first.get("SongName") or "").strip(),
+            album=(first.get("AlbumName") or "").strip(),
+            year=int(year) if year else None,
+            arrangements=tuple(arrangements),
+            tuning=tuning,
+        )
+
+
+def read_metadata(path) -> Optional[SongInfo]:
+    """SongInfo for path, or None if it can't be read."""
+    try:
+        with PsarcReader(path) as reader:
+            return reader.metadata()
+    except (OSError, PsarcError, ValueError) as e:
+        logger.debug(f"No metadata for {path}: {e}")
+        return None
+
+
+def _clean(text: str) -> str:
+    text = re.sub(r"[^\w.-]+", "-", text.strip()).strip("-.")
+    return re.sub(r"-{2,}", "-", text) or "Unknown"
+
+
+def canonical_name(info: SongInfo, current: str) -> str:
+    """Artist_Title, keeping the version and _m/_p tail of the current name."""
+    match = NAME_TAIL.search(current)
+    tail = match.group(1) if match else ""
+    return f"{_clean(info.artist)}_{_clean(info.title)}{tail}.psarc"
+
+
+def summary(info: Optional[SongInfo]) -> str:
+    if info is None:
+        return ""
+    album = f" ({info.album})" if info.album else ""
+    return (
+        f"{info.artist} - {info.title}{album} "
+        f"[{', '.join(info.arrangements)}] {info.tuning}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show metadata from PSARC files.")
+    parser.add_argument("files", nargs="+", help="psarc files to read")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    failed = 0
+    for path in args.files:
+        info = read_metadata(path)
+        if info is None:
+            print(f"{path}: unreadable", file=sys.stderr)
+            failed += 1
+        elif args.json:
+            print(json.dumps({"path": path, **info._asdict()}))
+        else:
+            print(f"{Path(path).name}: {summary(info)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,67 @@
 #!/usr/bin/env python3
-"""Move CDLC files to quarantine on the NAS, and sync removals/restores to rocksmithytoo."""
+"""Move CDLC files to quarantine on the NAS, and hold/release them on rocksmithytoo."""
 
 import argparse
-import shutil
-import subprocess
 import sys
 
-from wayward.config import LIVE, QUARANTINE, REMOTE_DLC, REMOTE_HOST, STAGING
-
-
-def rm_from_remote(filename: str):
-    """SSH rm a _m.psarc file from rocksmithytoo Steam DLC dir."""
-    if not filename.endswith("_m.psarc"):
-        return
-    remote_path = f"{REMOTE_DLC}{filename}"
-    result = subprocess.run(
-        ["ssh", REMOTE_HOST, "rm", "-f", remote_path],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode == 0:
-        print(f"  removed from rocksmithytoo: {filename}")
-    else:
-        print(
-            f"  ssh rm failed for {filename}: {result.stderr.strip()}", file=sys.stderr
-        )
-
-
-def scp_to_remote(filename: str):
-    """SCP a single _m.psarc file to the rocksmithytoo Steam DLC dir."""
-    if not filename.endswith("_m.psarc"):
-        return
-    src = LIVE / filename
-    dest = f"{REMOTE_HOST}:{REMOTE_DLC}"
-    result = subprocess.run(
-        ["scp", str(src), dest],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode == 0:
-        print(f"  synced to rocksmithytoo: {filename}")
-    else:
-        print(f"  scp failed for {filename}: {result.stderr.strip()}", file=sys.stderr)
+from wayward.catalog import get_catalog
+from wayward.config import LIVE, QUARANTINE, TIERS
+from wayward.mover import move
+from wayward.psarc import summary
+from wayward.transport import hold_on_remote, release_on_remote
 
 
 def list_quarantined():
-    files = sorted(QUARANTINE.glob("*.psarc"))
+    catalog = get_catalog()
+    files = catalog.list("quarantine")
     if not files:
         print("No quarantined files.")
         return
+    width = max(len(f.name) for f in files)
     for f in files:
-        print(f.name)
+        info = catalog.song("quarantine", f.name)
+        print(f"{f.name:<{width}}  {summary(info)}".rstrip())
 
 
 def quarantine(filenames: list[str]):
+    catalog = get_catalog()
+    quarantined = []
     for name in filenames:
-        src = LIVE / name
-        if not src.exists():
-            src = STAGING / name
-        if not src.exists():
+        tier = catalog.locate(name, ["live", "staging"])
+        if tier is None:
             print(f"Not found in live or staging: {name}", file=sys.stderr)
             continue
+        src = TIERS[tier] / name
         dest = QUARANTINE / name
-        shutil.move(str(src), str(dest))
+        try:
+            move(src, dest)
+        except FileNotFoundError:
+            catalog.record_remove(tier, name)
+            print(f"Not found in live or staging: {name}", file=sys.stderr)
+            continue
+        catalog.record_move(name, tier, "quarantine")
         print(f"Quarantined: {name} (from {src.parent.name}/)")
-        rm_from_remote(name)
+        quarantined.append(name)
+    hold_on_remote(quarantined)
 
 
 def restore(filenames: list[str]):
+    catalog = get_catalog()
+    restored = []
     for name in filenames:
-        src = QUARANTINE / name
-        if not src.exists():
+        if catalog.get("quarantine", name) is None:
+            print(f"Not found in quarantine: {name}", file=sys.stderr)
+            continue
+        try:
+            move(QUARANTINE / name, LIVE / name)
+        except FileNotFoundError:
+            catalog.record_remove("quarantine", name)
             print(f"Not found in quarantine: {name}", file=sys.stderr)
             continue
-        dest = LIVE / name
-        shutil.move(str(src), str(dest))
+        catalog.record_move(name, "quarantine", "live")
         print(f"Restored to live: {name}")
-        scp_to_remote(name)
+        restored.append(name)
+    release_on_remote(restored)
 
 
 def main():
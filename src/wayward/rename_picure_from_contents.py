@@ -11,6 +11,9 @@ from typing import Tuple
 NAME = "rename_picture_from_contents"
 logger = logging.getLogger(NAME)
 
+LLAVA_TEMP = 0.2
+LLAVA_TOKENS = 64
+
 
 def is_good_fileword(word: str) -> bool:
     _word = word.lower().replace("...", "")
@@ -57,7 +60,20 @@ def is_good_fileword(word: str) -> bool:
     return True
 
 
-def llm_generate_image_description(path) -> Tuple[str, str]:
+def filename_from_description(description: str) -> str:
+    words = [x for x in description.split(" ") if is_good_fileword(x)]
+    sorted = collections.Counter(words).most_common()
+    unzipped = [x for x, y in sorted]
+
+    return "_".join(unzipped)
+
+
+def llm_generate_image_description(path, service=None) -> Tuple[str, str]:
+    """Describe the image, via a resident DescriptionService if one is given."""
+    if service is not None:
+        description = service.describe(path)
+        return (filename_from_description(description), description)
+
     LLAVA = "/home/ahonnecke/local/bin/llava-v1.5-7b-q4.llamafile"
 
     if not os.path.exists(LLAVA):
@@ -65,9 +81,9 @@ def llm_generate_image_description(path) -> Tuple[str, str]:
             f"{LLAVA} not found. Please download and specify the correct path."
         )
 
-    TEMP = 0.2
+    TEMP = LLAVA_TEMP
     NGL = 999
-    TOKENS = 64
+    TOKENS = LLAVA_TOKENS
     cmd = [
         "/bin/bash",
         LLAVA,
@@ -100,21 +116,21 @@ def llm_generate_image_description(path) -> Tuple[str, str]:
         raise RuntimeError(stderr.decode())
 
     description = stdout.decode().strip()
-    words = [x for x in description.split(" ") if is_good_fileword(x)]
-    sorted = collections.Counter(words).most_common()
-    unzipped = [x for x, y in sorted]
 
-    return ("_".join(unzipped), description)
+    return (filename_from_description(description), description)
 
 
 def main(args) -> str | None:
-    raw_path = args.path
+    return rename(args.path, args.description)
+
+
+def rename(raw_path, write_description=True, service=None) -> str | None:
     filepath = os.path.abspath(raw_path)
     if not os.path.exists(filepath):
         logger.debug(f"{filepath}: file not found")
         return
 
-    newname, description = llm_generate_image_description(filepath)
+    newname, description = llm_generate_image_description(filepath, service)
     newpath = False
 
     if newname:
@@ -127,14 +143,14 @@ def main(args) -> str | None:
         logger.debug(f"Renaming {filepath} to {newpath}")
         os.rename(filepath, newpath)
 
-    if args.description:
+    if write_description:
         # Write the contents to a file
         description_file = f"{newpath}.txt"
         logger.debug(f"Writing description: {description} to ({description_file})")
         with open(description_file, "w") as f:
             f.write(description)
 
-    return str(newpath)
+    return str(newpath) if newpath else None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+"""Declarative routing table from file names to FileTypeHandlers.
+
+Rules are compiled once into lookup structures so routing a file costs a hash
+lookup on its suffix plus a walk of its name through a prefix trie, however
+many handlers are registered. Glob and predicate rules are checked linearly
+and should stay rare.
+"""
+
+import fnmatch
+import re
+from collections import defaultdict
+
+FIRST = "first"
+ALL = "all"
+
+
+class Rule:
+    """Send files to ``handler`` when every given condition matches.
+
+    ``suffixes`` and ``prefix`` are matched case-insensitively against the file
+    name, ``glob`` with fnmatch, and ``predicate`` is called with the Path.
+    Higher ``priority`` wins; ties go to the rule registered first.
+    """
+
+    def __init__(
+        self,
+        handler,
+        suffixes=(),
+        prefix=None,
+        glob=None,
+        predicate=None,
+        priority=0,
+    ):
+        self.handler = handler
+        self.suffixes = frozenset(s.lower() for s in suffixes)
+        self.prefix = prefix.lower() if prefix else None
+        self.glob = glob
+        self.pattern = re.compile(fnmatch.translate(glob.lower())) if glob else None
+        self.predicate = predicate
+        self.priority = priority
+        self.order = 0
+
+    def __repr__(self) -> str:
+        return f"Rule({self.handler}, priority={self.priority})"
+
+    def matches(self, path, name, suffix) -> bool:
+        if self.suffixes and suffix not in self.suffixes:
+            return False
+        if self.prefix and not name.startswith(self.prefix):
+            return False
+        if self.pattern and not self.pattern.match(name):
+            return False
+        if self.predicate and not self.predicate(path):
+            return False
+        return True
+
+
+class Router:
+    """Compiled rule index.
+
+    With ``mode=FIRST`` a file goes to the single best matching handler; with
+    ``mode=ALL`` it fans out to every match, in priority order.
+    """
+
+    def __init__(self, rules, mode=FIRST):
+        if mode not in (FIRST, ALL):
+            raise ValueError(f"Unknown routing mode: {mode}")
+        self.mode = mode
+        self.rules = list(rules)
+        self.by_suffix = defaultdict(list)
+        self.trie = {}
+        self.scanned = []
+
+        for order, rule in enumerate(self.rules):
+            rule.order = order
+            if rule.suffixes:
+                for suffix in rule.suffixes:
+                    self.by_suffix[suffix].append(rule)
+            elif rule.prefix:
+                node = self.trie
+                for char in rule.prefix:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(rule)
+            else:
+                self.scanned.append(rule)
+
+    @property
+    def handlers(self):
+        return [rule.handler for rule in self.rules]
+
+    def candidates(self, name, suffix):
+        found = list(self.by_suffix.get(suffix, ()))
+        node = self.trie
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        found.extend(self.scanned)
+        return found
+
+    def route(self, path):
+        """Return the handlers for path, best match first."""
+        name = path.name.lower()
+        suffix = path.suffix.lower()
+        matched = [
+            rule
+            for rule in self.candidates(name, suffix)
+            if rule.matches(path, name, suffix)
+        ]
+        matched.sort(key=lambda rule: (-rule.priority, rule.order))
+        if self.mode == FIRST:
+            matched = matched[:1]
+        return [rule.handler for rule in matched]
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Full-text index of screenshot OCR text and image descriptions.
+
+One row per image, keyed by its final path, holding its name, date, OCR text
+and LLaVA description. The handlers update a row as soon as they have the
+text, and an SQLite FTS5 table over those columns answers ranked queries
+(bm25, with the name weighted highest) without touching the files.
+``wayward-search --rebuild`` re-indexes a tree from the ``.ocr.txt`` and
+``<image>.txt`` sidecars that ``ocr_image.py``, the screenshot handler and
+``rename_picure_from_contents.py`` leave next to each image.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, NamedTuple
+
+from wayward.config import IMAGE_SUFFIXES, SEARCH_DB, SEARCH_ROOTS
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of each column in the ranking: name, ocr, description.
+WEIGHTS = (4.0, 1.0, 2.0)
+DATE_DIR = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class SearchError(RuntimeError):
+    pass
+
+
+class Hit(NamedTuple):
+    path: str
+    date: str
+    score: float
+    snippet: str
+
+
+def image_date(path: Path) -> str:
+    """The YYYY-MM-DD directory a handler filed path under, else its mtime."""
+    if DATE_DIR.match(path.parent.name):
+        return path.parent.name
+    try:
+        return time.strftime("%Y-%m-%d", time.localtime(path.stat().st_mtime))
+    except OSError:
+        return ""
+
+
+def ocr_sidecar(path: Path) -> Path:
+    return path.with_suffix(".ocr.txt")
+
+
+def sidecars(path: Path):
+    """(ocr text, description) from the sidecar files next to an image."""
+    found = []
+    for sidecar in (ocr_sidecar(path), Path(f"{path}.txt")):
+        try:
+            found.append(sidecar.read_text(errors="replace"))
+        except OSError:
+            found.append(None)
+    return tuple(found)
+
+
+def match_expression(query: str) -> str:
+    """Quote each word so punctuation isn't FTS syntax; the last one is a prefix."""
+    words = query.split()
+    if not words:
+        raise SearchError("empty query")
+    quoted = ['"' + word.replace('"', '""') + '"' for word in words]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+class SearchIndex:
+    def __init__(self, path=SEARCH_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        try:
+            self.db.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS images (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL UNIQUE,
+                    name TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    ocr TEXT NOT NULL DEFAULT '',
+                    description TEXT NOT NULL DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS images_date ON images (date);
+                CREATE VIRTUAL TABLE IF NOT EXISTS text USING fts5(
+                    name, ocr, description,
+                    content='images', content_rowid='id',
+                    tokenize='porter unicode61'
+                );
+                -- Keep the FTS table in step with images.
+                CREATE TRIGGER IF NOT EXISTS images_insert AFTER INSERT ON images
+                BEGIN
+                    INSERT INTO text (rowid, name, ocr, description)
+                    VALUES (new.id, new.name, new.ocr, new.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_delete AFTER DELETE ON images
+                BEGIN
+                    INSERT INTO text (text, rowid, name, ocr, description)
+                    VALUES ('delete', old.id, old.name, old.ocr, old.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_update AFTER UPDATE ON images
+                BEGIN
+                    INSERT INTO text (text, rowid, name, ocr, description)
+                    VALUES ('delete', old.id, old.name, old.ocr, old.description);
+                    INSERT INTO text (rowid, name, ocr, description)
+                    VALUES (new.id, new.name, new.ocr, new.description);
+                END;
+                """
+            )
+        except sqlite3.OperationalError as e:
+            raise SearchError(f"SQLite without FTS5 support? ({e})")
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            try:
+                yield self.db
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+
+    def update(self, path, ocr=None, description=None, date=None):
+        """Index path, keeping whichever of its texts aren't given."""
+        path = Path(path)
+        with self.transaction() as db:
+            self._upsert(db, path, ocr, description, date or image_date(path))
+
+    def _upsert(self, db, path, ocr, description, date):
+        db.execute(
+            """
+            INSERT INTO images (path, name, date, ocr, description)
+            VALUES (?, ?, ?, COALESCE(?, ''), COALESCE(?, ''))
+            ON CONFLICT (path) DO UPDATE SET
+                name = excluded.name,
+                date = excluded.date,
+                ocr = COALESCE(?, ocr),
+                description = COALESCE(?, description)
+            """,
+            (str(path), path.stem, date, ocr, description, ocr, description),
+        )
+
+    def remove(self, path):
+        with self.transaction() as db:
+            db.execute("DELETE FROM images WHERE path = ?", (str(path),))
+
+    def search(self, query, limit=20, since=None, until=None, raw=False) -> List[Hit]:
+        """Best matches first. raw passes query through as FTS5 syntax."""
+        expression = query if raw else match_expression(query)
+        sql = f"""
+            SELECT images.path, images.date, bm25(text, {", ".join(map(str, WEIGHTS))}),
+                   snippet(text, -1, '[', ']', '...', 12)
+            FROM text JOIN images ON images.id = text.rowid
+            WHERE text MATCH ?
+        """
+        params = [expression]
+        if since:
+            sql += " AND images.date >= ?"
+            params.append(since)
+        if until:
+            sql += " AND images.date <= ?"
+            params.append(until)
+        sql += " ORDER BY 3 LIMIT ?"
+        params.append(limit)
+        try:
+            with self.lock:
+                rows = self.db.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            raise SearchError(f"bad query {query!r}: {e}")
+        # bm25 is negative, more negative is better; report a positive score.
+        return [Hit(path, date, -score, snippet) for path, date, score, snippet in rows]
+
+    def rebuild(self, roots) -> int:
+        """Re-index every image under roots from its sidecars; returns count.
+
+        An image without a sidecar keeps the text already indexed for it
+        (the daemon indexes what it OCRs directly); rows for images that are
+        gone are dropped.
+        """
+        count = 0
+        with self.transaction() as db:
+            for root in roots:
+                root = Path(root).resolve()
+                found = set()
+                for dirpath, _, filenames in os.walk(root):
+                    for filename in filenames:
+                        path = Path(dirpath) / filename
+                        if path.suffix.lower() not in IMAGE_SUFFIXES:
+                            continue
+                        ocr, description = sidecars(path)
+                        self._upsert(db, path, ocr, description, image_date(path))
+                        found.add(str(path))
+                        count += 1
+                gone = [
+                    (path,)
+                    for (path,) in db.execute(
+                        "SELECT path FROM images WHERE path LIKE ? ESCAPE '\\'",
+                        (_like_prefix(root),),
+                    )
+                    if path not in found
+                ]
+                db.executemany("DELETE FROM images WHERE path = ?", gone)
+            db.execute("INSERT INTO text (text) VALUES ('optimize')")
+        logger.info(f"Indexed {count} images")
+        return count
+
+    def stats(self) -> dict:
+        with self.lock:
+            images, with_ocr, described = self.db.execute(
+                "SELECT COUNT(*), COUNT(NULLIF(ocr, '')), COUNT(NULLIF(description, '')) "
+                "FROM images"
+            ).fetchone()
+        return {"images": images, "ocr": with_ocr, "described": described}
+
+
+def _like_prefix(root: Path) -> str:
+    escaped = str(root).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.rstrip("/") + "/%"
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SearchIndex:
+    """Return the process-wide search index, opening it on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex()
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Search screenshot OCR text and image descriptions."
+    )
+    parser.add_argument("query", nargs="*", help="Words to look for")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--since", metavar="YYYY-MM-DD")
+    parser.add_argument("--until", metavar="YYYY-MM-DD")
+    parser.add_argument(
+        "--raw", action="store_true", help="Query is FTS5 syntax (AND, NEAR, ...)"
+    )
+    parser.add_argument("--json", action="store_true", help="Print JSON lines")
+    parser.add_argument(
+        "--rebuild",
+        nargs="*",
+        metavar="DIR",
+        help="Re-index images under DIR from their sidecars "
+        f"(default: {', '.join(map(str, SEARCH_ROOTS))})",
+    )
+    parser.add_argument("--stats", action="store_true", help="Show index size")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        index = SearchIndex()
+        if args.rebuild is not None:
+            started = time.monotonic()
+            count = index.rebuild(args.rebuild or SEARCH_ROOTS)
+            print(f"Indexed {count} images in {time.monotonic() - started:.1f}s.")
+            return
+        if args.stats:
+            print(json.dumps(index.stats(), indent=2))
+            return
+        if not args.query:
+            parser.error("give a query, --rebuild or --stats")
+        started = time.monotonic()
+        hits = index.search(
+            " ".join(args.query), args.limit, args.since, args.until, args.raw
+        )
+    except SearchError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+    for hit in hits:
+        if args.json:
+            print(json.dumps(hit._asdict()))
+        else:
+            print(f"{hit.date}  {hit.path}\n            {hit.snippet}")
+    if not args.json:
+        elapsed = (time.monotonic() - started) * 1000
+        print(f"{len(hits)} hits in {elapsed:.1f} ms", file=sys.stderr)
+    sys.exit(0 if hits else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Decide when a downloaded file has stopped changing.
+
+One timer thread tracks every pending path instead of parking a sleeping
+thread per download. A path is stable once its (size, mtime, inode) signature
+holds still for a quiet period. The quiet period is short when the writer has
+closed the file (inotify ``IN_CLOSE_WRITE``, delivered by watchdog as a
+``closed`` event) and otherwise starts at ``STABILIZE_SETTLE`` and doubles every
+time the file is seen changing, so a stalled download is not mistaken for a
+finished one.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from wayward.config import (
+    STABILIZE_CLOSED_DELAY,
+    STABILIZE_MAX_DELAY,
+    STABILIZE_SETTLE,
+)
+from wayward.metrics import STABILIZE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def signature(path):
+    """Return (size, mtime_ns, inode) for path, or None if it is gone."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class _Pending:
+    __slots__ = ("path", "callbacks", "signature", "quiet", "closed", "due", "since")
+
+    def __init__(self, path, quiet):
+        self.path = path
+        self.callbacks = []
+        self.signature = signature(path)
+        self.quiet = quiet
+        self.closed = False
+        self.due = 0.0
+        self.since = time.monotonic()
+
+
+class Stabilizer:
+    """Shared scheduler that reports each tracked path once it is stable.
+
+    Callbacks are called as ``callback(path, size)`` on the stabilizer thread;
+    size is 0 if the file disappeared. They should hand work off quickly.
+    """
+
+    def __init__(
+        self,
+        settle=STABILIZE_SETTLE,
+        closed_delay=STABILIZE_CLOSED_DELAY,
+        max_delay=STABILIZE_MAX_DELAY,
+    ):
+        self.settle = settle
+        self.closed_delay = closed_delay
+        self.max_delay = max_delay
+        self.pending = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(
+            target=self._run, name="wayward-stabilizer", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def track(self, path, callback, delay=None):
+        """Start watching path, or note fresh activity if already watched.
+
+        delay replaces the first quiet period, e.g. to offer a path that
+        was already stable again later.
+        """
+        with self.cond:
+            entry = self.pending.get(path)
+            if entry is None:
+                entry = self.pending[path] = _Pending(path, self.settle)
+                self._schedule(entry, entry.quiet if delay is None else delay)
+            else:
+                self._activity(entry)
+            entry.callbacks.append(callback)
+
+    def touch(self, path):
+        """Record a modification event for a tracked path."""
+        with self.cond:
+            entry = self.pending.get(path)
+            if entry is not None:
+                self._activity(entry)
+
+    def closed(self, path):
+        """Record that the writer closed path; check it again shortly."""
+        with self.cond:
+            entry = self.pending.get(path)
+            if entry is not None:
+                entry.closed = True
+                entry.signature = signature(path)
+                self._schedule(entry, self.closed_delay)
+
+    def is_closed(self, path) -> bool:
+        """Whether the writer closed tracked path and hasn't written since."""
+        with self.cond:
+            entry = self.pending.get(path)
+            return entry is not None and entry.closed
+
+    def forget(self, path):
+        with self.cond:
+            self.pending.pop(path, None)
+
+    def wait(self, path, timeout=None) -> int:
+        """Block until path is stable and return its size (0 if it vanished)."""
+        done = threading.Event()
+        result = []
+
+        def _callback(_path, size):
+            result.append(size)
+            done.set()
+
+        self.track(path, _callback)
+        if not done.wait(timeout):
+            return 0
+        return result[0]
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _activity(self, entry):
+        entry.closed = False
+        self._schedule(entry, entry.quiet)
+
+    def _schedule(self, entry, delay):
+        due = time.monotonic() + delay
+        # Pushing later deadlines is deferred until the old one pops, so a
+        # stream of modified events costs one heap entry, not one per event.
+        if entry.due == 0.0 or due < entry.due:
+            heapq.heappush(self.heap, (due, next(self.counter), entry.path))
+            self.cond.notify()
+        entry.due = due
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                due, _, path = self.heap[0]
+                if due > now:
+                    self.cond.wait(due - now)
+                    continue
+                heapq.heappop(self.heap)
+                entry = self.pending.get(path)
+                if entry is None or entry.due < due:
+                    # Forgotten, or superseded by an earlier deadline.
+                    continue
+                if entry.due > due:
+                    heapq.heappush(
+                        self.heap, (entry.due, next(self.counter), entry.path)
+                    )
+                    continue
+                ready = self._check(entry)
+                if ready is None:
+                    continue
+                del self.pending[path]
+
+            size = ready
+            waited = time.monotonic() - entry.since
+            STABILIZE_SECONDS.observe(waited)
+            logger.debug(f"{path} stable at {size} after {waited:.3f}s")
+            for callback in entry.callbacks:
+                try:
+                    callback(path, size)
+                except Exception as e:
+                    logger.error(f"Stabilization callback failed for {path}: {e}")
+                    logger.exception(e)
+
+    def _check(self, entry):
+        """Return the final size if entry is stable, else reschedule it."""
+        current = signature(entry.path)
+        if current is None:
+            return 0
+        if current == entry.signature:
+            return current[0]
+        if entry.signature is not None:
+            # Still changing after a quiet window: the writer stalls, so
+            # demand a longer quiet period next time.
+            entry.closed = False
+            entry.quiet = min(entry.quiet * 2, self.max_delay)
+        entry.signature = current
+        entry.due = 0.0
+        self._schedule(entry, entry.quiet)
+        return None
@@ -0,0 +1,299 @@
+"""Batched file operations against rocksmithytoo's Steam DLC directory.
+
+``SshTransport`` keeps one multiplexed SSH master connection open
+(ControlMaster/ControlPersist), so every scp/ssh after the first skips the
+handshake, and each operation takes a whole batch of files in a single
+round trip. ``LocalTransport`` does the same against a local directory for
+testing; set ``WAYWARD_REMOTE_DIR`` to use it.
+
+Quarantine doesn't delete from rocksmithytoo: it renames the file into
+``REMOTE_DISABLED``, outside Rocksmith's scan path, and restore renames it
+back. Only a held copy that is missing or no longer matches live/ is
+uploaded again.
+"""
+
+import abc
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+from wayward.cache import hash_file
+from wayward.catalog import REMOTE_DLC_TIER, REMOTE_HELD_TIER, get_catalog
+from wayward.config import (
+    LIVE,
+    REMOTE_CONTROL_PATH,
+    REMOTE_CONTROL_PERSIST,
+    REMOTE_DISABLED,
+    REMOTE_DLC,
+    REMOTE_HOST,
+    REMOTE_LOCAL_DIR,
+    REMOTE_STAT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def remote_quote(path: str) -> str:
+    """Shell-quote a remote path, leaving a leading ~/ for the remote shell."""
+    if path.startswith("~/"):
+        return "~/" + shlex.quote(path[2:])
+    return shlex.quote(path)
+
+
+class TransportError(RuntimeError):
+    pass
+
+
+class Transport(abc.ABC):
+    @abc.abstractmethod
+    def push(self, paths):
+        """Copy local files into the remote DLC dir in one batch."""
+
+    @abc.abstractmethod
+    def remove(self, names, tier=REMOTE_DLC_TIER):
+        """Delete files by name from the remote DLC (or holding) dir in one batch."""
+
+    @abc.abstractmethod
+    def move(self, names, tier) -> list:
+        """Rename files into tier from the other remote dir; return those moved."""
+
+    @abc.abstractmethod
+    def listing(self) -> dict:
+        """Return {name: size} of every _m.psarc in the remote DLC dir."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SshTransport(Transport):
+    def __init__(
+        self,
+        host=REMOTE_HOST,
+        remote_dir=REMOTE_DLC,
+        control_path=REMOTE_CONTROL_PATH,
+        persist=REMOTE_CONTROL_PERSIST,
+        held_dir=REMOTE_DISABLED,
+    ):
+        self.host = host
+        self.remote_dir = remote_dir
+        self.dirs = {REMOTE_DLC_TIER: remote_dir, REMOTE_HELD_TIER: held_dir}
+        self.control_path = Path(control_path)
+        self.control_path.parent.mkdir(parents=True, exist_ok=True)
+        self.options = [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={self.control_path}",
+            "-o",
+            f"ControlPersist={persist}",
+        ]
+
+    def push(self, paths):
+        paths = [str(p) for p in paths]
+        if not paths:
+            return
+        self._run(
+            ["scp", *self.options, *paths, f"{self.host}:{self.remote_dir}"],
+            f"scp of {len(paths)} files",
+        )
+
+    def remove(self, names, tier=REMOTE_DLC_TIER):
+        if not names:
+            return
+        directory = self.dirs[tier]
+        targets = " ".join(remote_quote(f"{directory}{name}") for name in names)
+        self.ssh(f"rm -f -- {targets}")
+
+    def move(self, names, tier) -> list:
+        if not names:
+            return []
+        src = self.dirs[
+            REMOTE_DLC_TIER if tier == REMOTE_HELD_TIER else REMOTE_HELD_TIER
+        ]
+        dst = remote_quote(self.dirs[tier])
+        quoted = " ".join(shlex.quote(name) for name in names)
+        # One round trip; report each name that moved so missing ones can be
+        # pushed instead.
+        out = self.ssh(
+            f"mkdir -p {dst} && cd {remote_quote(src)} 2>/dev/null && "
+            f'for f in {quoted}; do mv -f -- "$f" {dst} 2>/dev/null && echo "$f"; done;'
+            " true"
+        )
+        moved = set(out.splitlines())
+        return [name for name in names if name in moved]
+
+    def listing(self) -> dict:
+        # One round trip; the glob stays literal (and stat fails) if empty.
+        out = self.ssh(
+            f"cd {remote_quote(self.remote_dir)} && {REMOTE_STAT} -- *_m.psarc"
+            " 2>/dev/null || true"
+        )
+        sizes = {}
+        for line in out.splitlines():
+            size, _, name = line.partition(" ")
+            if size.isdigit() and name.endswith("_m.psarc"):
+                sizes[name] = int(size)
+        return sizes
+
+    def ssh(self, command: str) -> str:
+        """Run a shell command on the remote host, return its stdout."""
+        return self._run(
+            ["ssh", *self.options, self.host, command], f"ssh {command[:60]}"
+        )
+
+    def close(self):
+        # ControlPersist keeps the master up for later CLI runs; nothing to do.
+        pass
+
+    def _run(self, cmd, what) -> str:
+        logger.debug(" ".join(cmd))
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise TransportError(f"{what} failed: {result.stderr.strip()}")
+        return result.stdout
+
+
+class LocalTransport(Transport):
+    def __init__(self, root=REMOTE_LOCAL_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.dirs = {
+            REMOTE_DLC_TIER: self.root,
+            REMOTE_HELD_TIER: self.root.with_name(f"{self.root.name}_disabled"),
+        }
+
+    def push(self, paths):
+        for path in paths:
+            shutil.copy2(path, self.root / Path(path).name)
+
+    def remove(self, names, tier=REMOTE_DLC_TIER):
+        for name in names:
+            (self.dirs[tier] / name).unlink(missing_ok=True)
+
+    def move(self, names, tier) -> list:
+        src = self.dirs[
+            REMOTE_DLC_TIER if tier == REMOTE_HELD_TIER else REMOTE_HELD_TIER
+        ]
+        self.dirs[tier].mkdir(parents=True, exist_ok=True)
+        moved = []
+        for name in names:
+            try:
+                os.replace(src / name, self.dirs[tier] / name)
+            except FileNotFoundError:
+                continue
+            moved.append(name)
+        return moved
+
+    def listing(self) -> dict:
+        with os.scandir(self.root) as entries:
+            return {
+                entry.name: entry.stat().st_size
+                for entry in entries
+                if entry.name.endswith("_m.psarc")
+            }
+
+
+def get_transport() -> Transport:
+    if REMOTE_LOCAL_DIR:
+        return LocalTransport()
+    return SshTransport()
+
+
+def sync_to_remote(filenames, transport=None):
+    """Push the _m.psarc files among filenames from live/ in one batch."""
+    names = [name for name in filenames if name.endswith("_m.psarc")]
+    if not names:
+        return
+    transport = transport or get_transport()
+    try:
+        transport.push([LIVE / name for name in names])
+    except TransportError as e:
+        print(f"  sync to rocksmithytoo failed: {e}", file=sys.stderr)
+        return
+    get_catalog().record_pushed(names)
+    for name in names:
+        print(f"  synced to rocksmithytoo: {name}")
+
+
+def remove_from_remote(filenames, transport=None):
+    """Delete the _m.psarc files among filenames on rocksmithytoo in one batch."""
+    names = [name for name in filenames if name.endswith("_m.psarc")]
+    if not names:
+        return
+    transport = transport or get_transport()
+    try:
+        transport.remove(names)
+    except TransportError as e:
+        print(f"  remove from rocksmithytoo failed: {e}", file=sys.stderr)
+        return
+    get_catalog().forget_remote(names)
+    for name in names:
+        print(f"  removed from rocksmithytoo: {name}")
+
+
+def hold_on_remote(filenames, transport=None):
+    """Park the _m.psarc files among filenames outside Rocksmith's DLC dir."""
+    names = [name for name in filenames if name.endswith("_m.psarc")]
+    if not names:
+        return
+    transport = transport or get_transport()
+    try:
+        moved = transport.move(names, REMOTE_HELD_TIER)
+    except TransportError as e:
+        print(f"  disable on rocksmithytoo failed: {e}", file=sys.stderr)
+        return
+    catalog = get_catalog()
+    catalog.record_remote_move(moved, REMOTE_HELD_TIER)
+    for name in moved:
+        print(f"  disabled on rocksmithytoo: {name}")
+    absent = [name for name in names if name not in moved]
+    catalog.forget_remote(absent)
+    for name in absent:
+        print(f"  not on rocksmithytoo: {name}")
+
+
+def _held_is_current(held, entry) -> bool:
+    """True if the held remote copy matches the live/ file."""
+    if entry is None:
+        return False
+    if (held.size, held.mtime_ns) == (entry.size, entry.mtime_ns):
+        return True
+    if held.hash is None or held.size != entry.size:
+        return False
+    return held.hash == (entry.hash or hash_file(LIVE / entry.name))
+
+
+def release_on_remote(filenames, transport=None):
+    """Move held _m.psarc files back into the DLC dir; upload only the rest."""
+    names = [name for name in filenames if name.endswith("_m.psarc")]
+    if not names:
+        return
+    transport = transport or get_transport()
+    catalog = get_catalog()
+    held = catalog.manifest(REMOTE_HELD_TIER)
+    current = [
+        name
+        for name in names
+        if name in held and _held_is_current(held[name], catalog.get("live", name))
+    ]
+    try:
+        moved = transport.move(current, REMOTE_DLC_TIER)
+        stale = [name for name in names if name in held and name not in current]
+        transport.remove(stale, REMOTE_HELD_TIER)
+    except TransportError as e:
+        print(f"  enable on rocksmithytoo failed: {e}", file=sys.stderr)
+        moved = []
+    catalog.record_remote_move(moved, REMOTE_DLC_TIER)
+    for name in moved:
+        print(f"  enabled on rocksmithytoo: {name}")
+    sync_to_remote([name for name in names if name not in moved], transport)
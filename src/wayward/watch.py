@@ -0,0 +1,426 @@
+"""Watch several directory trees on one inotify observer, within kernel limits.
+
+Each ``WatchRoot`` has its own routing table, a recursion ``depth`` (0 is
+the root alone, None is unlimited) and ``include``/``exclude`` patterns that
+pick the subdirectories worth watching. A root watching its whole tree is a
+single recursive inotify watch, and one with depth 0 a single plain watch.
+A root with filters or a finite depth gets one non-recursive watch per
+directory it selects, so ``node_modules`` and friends cost nothing.
+
+Watchdog's inotify backend spends one inotify instance per scheduled path,
+and both ``fs.inotify.max_user_watches`` and ``max_user_instances`` are
+shared with every other process of the user, so wayward only plans to use
+``INOTIFY_SHARE`` of each. A filtered root whose directories need more
+instances than are left falls back to one recursive watch of its whole
+tree; the handler then drops events from unselected directories with
+``WatchRoot.contains``. When even that has more directories than the
+watches left, the root itself keeps a non-recursive inotify watch (so
+files landing in it are still seen at once, with their close-write events)
+and only its subdirectories are polled. Roots on a network filesystem
+(inotify never hears about changes made by other NFS clients) are polled
+entirely. One snapshot-diff poller serves them all, and its directory
+listing skips whatever the root's filters exclude.
+"""
+
+import fnmatch
+import logging
+import os
+import threading
+from pathlib import Path, PurePosixPath
+from typing import List, Optional
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserverVFS
+
+from wayward.config import INOTIFY_SHARE, NETWORK_FILESYSTEMS, POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+INOTIFY = "inotify"
+POLL = "poll"
+# One non-recursive inotify watch per selected directory.
+PER_DIRECTORY = "inotify per directory"
+# Root on inotify, subdirectories polled.
+MIXED = "inotify+poll"
+
+# Kernel defaults, for when /proc can't tell us.
+DEFAULT_MAX_WATCHES = 8192
+DEFAULT_MAX_INSTANCES = 128
+
+
+def _read_limit(name, default) -> int:
+    try:
+        return int(Path(f"/proc/sys/fs/inotify/{name}").read_text())
+    except (OSError, ValueError):
+        return default
+
+
+def inotify_limits():
+    """(max_user_watches, max_user_instances) for this kernel."""
+    return (
+        _read_limit("max_user_watches", DEFAULT_MAX_WATCHES),
+        _read_limit("max_user_instances", DEFAULT_MAX_INSTANCES),
+    )
+
+
+def mount_type(path) -> Optional[str]:
+    """Filesystem type of the mount holding path, from /proc/mounts."""
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Spaces and friends are octal-escaped: /mnt/my\040nas
+                mountpoint = fields[1].encode().decode("unicode_escape")
+                inside = path == mountpoint or path.startswith(
+                    mountpoint.rstrip("/") + "/"
+                )
+                if inside and len(mountpoint) >= len(best):
+                    best, fstype = mountpoint, fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+def is_network_fs(path) -> bool:
+    return mount_type(path) in NETWORK_FILESYSTEMS
+
+
+def count_directories(path) -> int:
+    """Directories at or below path, i.e. what a recursive inotify watch costs.
+
+    Recursive watches can't skip excluded directories, so neither does this.
+    """
+    return sum(1 for _ in os.walk(path))
+
+
+def _matches(rel: PurePosixPath, patterns) -> bool:
+    return any(
+        fnmatch.fnmatch(rel.name, pattern) or fnmatch.fnmatch(str(rel), pattern)
+        for pattern in patterns
+    )
+
+
+class WatchRoot:
+    """A directory tree to watch and the rules for files that land in it.
+
+    ``include`` and ``exclude`` are fnmatch patterns tried against each
+    subdirectory's name and its path relative to the root. An excluded
+    directory is skipped with everything below it; with ``include`` given, a
+    subdirectory is only watched if it or one of its ancestors matches.
+    ``poll`` forces (True) or forbids (False) polling; by default roots on a
+    network filesystem are polled.
+    """
+
+    def __init__(self, path, router=None, depth=0, include=(), exclude=(), poll=None):
+        self.path = Path(path).resolve()
+        self.router = router
+        self.depth = depth
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.poll = poll
+
+    def __repr__(self) -> str:
+        return f"WatchRoot({self.path}, depth={self.depth})"
+
+    @property
+    def whole_tree(self) -> bool:
+        """True if every directory below the root is watched."""
+        return self.depth is None and not self.include and not self.exclude
+
+    def relative(self, path) -> Optional[PurePosixPath]:
+        try:
+            return PurePosixPath(Path(path).relative_to(self.path))
+        except ValueError:
+            return None
+
+    def selects(self, directory) -> bool:
+        """Whether directory is one this root watches."""
+        rel = self.relative(directory)
+        if rel is None:
+            return False
+        parts = rel.parts
+        if not parts:
+            return True
+        if self.depth is not None and len(parts) > self.depth:
+            return False
+        prefixes = [PurePosixPath(*parts[: n + 1]) for n in range(len(parts))]
+        if any(_matches(prefix, self.exclude) for prefix in prefixes):
+            return False
+        if self.include:
+            return any(_matches(prefix, self.include) for prefix in prefixes)
+        return True
+
+    def contains(self, path) -> bool:
+        """Whether a file at path is inside the watched part of this root."""
+        return self.selects(Path(path).parent)
+
+    def directories(self, start=None) -> List[Path]:
+        """Every watched directory at or below start (default: the root)."""
+        found = []
+        pending = [Path(start or self.path)]
+        while pending:
+            directory = pending.pop()
+            if not self.selects(directory):
+                continue
+            found.append(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    pending.extend(
+                        Path(entry.path)
+                        for entry in entries
+                        if entry.is_dir(follow_symlinks=False)
+                    )
+            except OSError as e:
+                logger.debug(f"Can't list {directory}: {e}")
+        return found
+
+    def listdir(self, path):
+        """os.scandir for the poller, leaving out directories not watched."""
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and not self.selects(entry.path):
+                    continue
+                yield entry
+
+
+class InotifyBudget:
+    """Our share of the per-user inotify watch and instance limits."""
+
+    def __init__(self, share=INOTIFY_SHARE):
+        watches, instances = inotify_limits()
+        self.watches = int(watches * share)
+        self.instances = int(instances * share)
+        self.used_watches = 0
+        self.used_instances = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.used_watches}/{self.watches} watches, "
+            f"{self.used_instances}/{self.instances} instances"
+        )
+
+    def reserve(self, watches, instances=1) -> bool:
+        with self.lock:
+            if (
+                self.used_watches + watches > self.watches
+                or self.used_instances + instances > self.instances
+            ):
+                return False
+            self.used_watches += watches
+            self.used_instances += instances
+            return True
+
+    def release(self, watches, instances=1):
+        with self.lock:
+            self.used_watches = max(0, self.used_watches - watches)
+            self.used_instances = max(0, self.used_instances - instances)
+
+
+class _DirectoryTracker(FileSystemEventHandler):
+    """Follow directories appearing and disappearing under an inotify root."""
+
+    def __init__(self, watches, root):
+        self.watches = watches
+        self.root = root
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.watches.add_directory(self.root, Path(event.src_path))
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.watches.remove_directory(self.root, Path(event.src_path))
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.watches.remove_directory(self.root, Path(event.src_path))
+            self.watches.add_directory(self.root, Path(event.dest_path))
+
+
+class WatchSet:
+    """Schedule every root on one inotify observer and one shared poller."""
+
+    def __init__(self, roots, handler, budget=None, poll_interval=POLL_INTERVAL):
+        self.roots = list(roots)
+        self.handler = handler
+        self.budget = budget if budget is not None else InotifyBudget()
+        self.poll_interval = poll_interval
+        self.lock = threading.RLock()
+        self.observer = None
+        self.poller = None
+        self.modes = {}
+        # Directory => (watch, observer, inotify watches reserved, instances)
+        self.watches = {}
+        # Root => watches reserved for directories created since start()
+        self.extra = {}
+
+    def start(self):
+        with self.lock:
+            self.observer = Observer()
+            self.poller = PollingObserverVFS(
+                os.stat, self.listdir, polling_interval=self.poll_interval
+            )
+            for root in self.roots:
+                self.modes[root.path] = self._schedule(root)
+            self.observer.start()
+            self.poller.start()
+        for root in self.roots:
+            logger.info(
+                f"Watching {root.path} ({self.modes[root.path]}, depth {root.depth})"
+            )
+        logger.info(f"inotify budget: {self.budget}")
+
+    def stop(self):
+        with self.lock:
+            for observer in (self.observer, self.poller):
+                if observer is not None:
+                    observer.stop()
+                    observer.join()
+            for _, _, watches, instances in self.watches.values():
+                self.budget.release(watches, instances)
+            self.watches.clear()
+            self.budget.release(sum(self.extra.values()), 0)
+            self.extra.clear()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def is_alive(self) -> bool:
+        return self.observer.is_alive() and self.poller.is_alive()
+
+    def directories(self):
+        """Every directory currently watched, for catch-up scans."""
+        with self.lock:
+            roots = list(self.roots)
+        return [directory for root in roots for directory in root.directories()]
+
+    def _schedule(self, root) -> str:
+        if root.poll or (root.poll is None and is_network_fs(root.path)):
+            self._poll(root.path, recursive=root.depth != 0)
+            return POLL
+
+        if root.depth == 0:
+            if self.budget.reserve(1, 1):
+                self._watch(root.path, 1)
+                return INOTIFY
+        else:
+            tracker = _DirectoryTracker(self, root)
+            if not root.whole_tree:
+                # directories() prunes excluded and too-deep subtrees.
+                selected = root.directories()
+                if self.budget.reserve(len(selected), len(selected)):
+                    for directory in selected:
+                        self._watch_directory(directory, tracker, reserved=True)
+                    return PER_DIRECTORY
+            watches = count_directories(root.path)
+            if self.budget.reserve(watches, 1):
+                self._watch(root.path, watches, recursive=True, tracker=tracker)
+                return INOTIFY
+            if self.budget.reserve(1, 1):
+                self._watch(root.path, 1, tracker=tracker)
+                subtrees = [d for d in root.directories() if d.parent == root.path]
+                for directory in subtrees:
+                    self._poll(directory, recursive=True)
+                logger.warning(
+                    f"{root.path}: {watches} directories won't fit the inotify "
+                    f"budget ({self.budget}), polling its {len(subtrees)} subtrees"
+                )
+                return MIXED
+
+        logger.warning(
+            f"{root.path}: no inotify budget left ({self.budget}), polling it instead"
+        )
+        self._poll(root.path, recursive=root.depth != 0)
+        return POLL
+
+    def _watch(self, directory, watches, recursive=False, tracker=None):
+        watch = self.observer.schedule(
+            self.handler, str(directory), recursive=recursive
+        )
+        if tracker is not None:
+            self.observer.add_handler_for_watch(tracker, watch)
+        self.watches[directory] = (watch, self.observer, watches, 1)
+
+    def _watch_directory(self, directory, tracker, reserved=False):
+        """Watch one selected directory, polling it if the budget is spent."""
+        if not reserved and not self.budget.reserve(1, 1):
+            logger.warning(f"{directory}: over the inotify budget, polling it")
+            self._poll(directory)
+            return
+        try:
+            self._watch(directory, 1, tracker=tracker)
+        except OSError as e:
+            # Gone again already; its parent's watch reported the removal.
+            self.budget.release(1, 1)
+            logger.debug(f"Could not watch {directory}: {e}")
+
+    def _poll(self, directory, recursive=False):
+        watch = self.poller.schedule(self.handler, str(directory), recursive=recursive)
+        self.watches[directory] = (watch, self.poller, 0, 0)
+
+    def add_directory(self, root, directory):
+        """Account for a new directory under an inotify root and scan it.
+
+        A recursive watch follows the directory by itself but spends more
+        inotify watches on it. A per-directory root watches each selected
+        directory in the new tree, polling those the budget can't cover; on
+        a mixed root a new top-level directory is handed to the poller.
+        """
+        with self.lock:
+            mode = self.modes.get(root.path)
+            if mode == PER_DIRECTORY:
+                tracker = _DirectoryTracker(self, root)
+                for path in root.directories(start=directory):
+                    if path not in self.watches:
+                        self._watch_directory(path, tracker)
+            elif mode == INOTIFY and root.depth != 0:
+                added = count_directories(directory)
+                if not self.budget.reserve(added, 0):
+                    logger.warning(f"{directory}: over the inotify budget")
+                self.extra[root.path] = self.extra.get(root.path, 0) + added
+            elif (
+                mode == MIXED
+                and directory.parent == root.path
+                and root.selects(directory)
+                and directory not in self.watches
+            ):
+                try:
+                    self._poll(directory, recursive=True)
+                except OSError as e:
+                    logger.debug(f"Could not poll {directory}: {e}")
+        # Anything written before the watch saw it (e.g. unpacked archives).
+        for path in root.directories(start=directory):
+            self.handler.reconcile(path)
+
+    def remove_directory(self, root, directory):
+        with self.lock:
+            if self.modes.get(root.path) == INOTIFY and self.extra.get(root.path):
+                # Its subdirectories can't be counted any more; give back one
+                # watch, and the next restart() counts the tree afresh.
+                self.extra[root.path] -= 1
+                self.budget.release(1, 0)
+            for path in [
+                p
+                for p in self.watches
+                if p != root.path and (p == directory or directory in p.parents)
+            ]:
+                watch, observer, watches, instances = self.watches.pop(path)
+                try:
+                    observer.unschedule(watch)
+                except KeyError:
+                    pass
+                self.budget.release(watches, instances)
+
+    def listdir(self, path):
+        """Directory listing for the poller, filtered by the owning root."""
+        owners = [root for root in self.roots if root.relative(path) is not None]
+        if not owners:
+            return os.scandir(path)
+        return max(owners, key=lambda root: len(root.path.parts)).listdir(path)